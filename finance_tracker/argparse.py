@@ -1,7 +1,7 @@
 """
 Module with argument parsing
 """
-from argparse import ArgumentParser
+from argparse import SUPPRESS, ArgumentParser, ArgumentTypeError
 from itertools import chain
 
 
@@ -18,7 +18,47 @@ def process_data(data: str):
     return {key: value}
 
 
+def process_list(data: str) -> list[str]:
+    """
+    Process a comma-separated list of items
+    """
+    return [item.strip() for item in data.split(",") if item.strip()]
+
+
+def process_aggregates(data: str) -> list[tuple[str, str]]:
+    """
+    Process a comma-separated list of aggregates in the form FUNCTION:COLUMN
+    """
+    result = []
+    for item in process_list(data):
+        function, sep, column = item.partition(":")
+        if not sep:
+            raise ArgumentTypeError(f"Invalid aggregate: {item}. Expected FUNCTION:COLUMN")
+        result.append((function, column))
+    return result
+
+
+class IntermixedArgumentParser(ArgumentParser):
+    """
+    Argument parser that accepts options between positional arguments, so that KEY=VALUE pairs
+    can be given after options of an action
+    """
+    _intermixed = False
+
+    def parse_known_args(self, args=None, namespace=None):
+        #   The intermixed parsing calls back into this method for its passes
+        if self._intermixed:
+            return super().parse_known_args(args, namespace)
+
+        self._intermixed = True
+        try:
+            return self.parse_known_intermixed_args(args, namespace)
+        finally:
+            self._intermixed = False
+
+
 class Parser:
+    db_profiles = ("safe", "fast")
     objects = (
         "transaction",
         "category",
@@ -36,14 +76,24 @@ class Parser:
             help="Path to database file",
         )
         parser.add_argument("-v", "--verbose", help="Print verbose messages", action="store_true")
+        parser.add_argument(
+            "--db-profile",
+            help="SQLite settings: safe - full sync on commit, fast - faster writes",
+            choices=self.db_profiles,
+            default="safe",
+        )
 
-        subparsers = parser.add_subparsers(dest="action", required=True)
+        subparsers = parser.add_subparsers(
+            dest="action",
+            required=True,
+            parser_class=IntermixedArgumentParser,
+        )
         c1 = self.add_action(subparsers, "create", "Create an item")
         c2 = self.add_action(subparsers, "c", "Create an item")
-        _ = self.add_action(subparsers, "update", "Update an item")
-        _ = self.add_action(subparsers, "u", "Update an item")
-        _ = self.add_action(subparsers, "delete", "Delete an item")
-        _ = self.add_action(subparsers, "d", "Delete an item")
+        u1 = self.add_action(subparsers, "update", "Update an item")
+        u2 = self.add_action(subparsers, "u", "Update an item")
+        d1 = self.add_action(subparsers, "delete", "Delete an item")
+        d2 = self.add_action(subparsers, "d", "Delete an item")
         _ = self.add_action(subparsers, "get", "Get an item")
         _ = self.add_action(subparsers, "g", "Get an item")
         q1 = self.add_action(subparsers, "query", "Query for items")
@@ -51,15 +101,128 @@ class Parser:
         _ = self.add_action(subparsers, "help", "Get a list of data items")
         _ = self.add_action(subparsers, "h", "Get a list of data items")
 
-        _ = subparsers.add_parser("report", help="Run report server")
+        report = subparsers.add_parser("report", help="Run report server")
+        report.add_argument(
+            "--db-profile",
+            help="SQLite settings: safe - full sync on commit, fast - faster writes",
+            choices=self.db_profiles,
+            default=SUPPRESS,
+        )
+        report.add_argument(
+            "-w",
+            "--workers",
+            help="Serve with a production server in this many processes. 0 runs the development "
+            "server",
+            type=int,
+            default=0,
+        )
+        report.add_argument(
+            "-t",
+            "--threads",
+            help="Threads per worker process of the production server",
+            type=int,
+            default=4,
+        )
+        report.add_argument(
+            "-b",
+            "--bind",
+            help="Address to listen on as HOST:PORT",
+            default="127.0.0.1:5000",
+        )
+        report.add_argument(
+            "--warm-up",
+            help="Precompute the summaries of the latest N periods at startup. 0 disables",
+            type=int,
+            default=0,
+        )
+        report.add_argument(
+            "--render-workers",
+            help="Render charts in this many worker processes. 0 renders in the request thread",
+            type=int,
+            default=0,
+        )
+        _ = subparsers.add_parser("explain", help="Print query plans of the summary report")
+        _ = subparsers.add_parser(
+            "rebuild-aggregates",
+            help="Recompute the monthly transaction rollup used by the reports",
+        )
 
         #   Add bonus options
         c1.add_argument("-q", "--qr-code", help="Create from QR code", action="store_true")
         c2.add_argument("-q", "--qr-code", help="Create from QR code", action="store_true")
-        q1.add_argument("-l", "--limit", help="How many rows to return", type=int, default=100)
-        q2.add_argument("-l", "--limit", help="How many rows to return", type=int, default=100)
+        for item in (c1, c2):
+            item.add_argument(
+                "-f",
+                "--file",
+                help="Create one item per row of a CSV file with a header of data keys",
+            )
+            item.add_argument(
+                "--on-conflict",
+                help="When an item with the same code exists: update it or do nothing",
+                choices=("update", "nothing"),
+            )
+            item.add_argument(
+                "-b",
+                "--batch-size",
+                help="How many rows to insert per statement when creating from a file",
+                type=int,
+                default=500,
+            )
+        for item in (u1, u2, d1, d2):
+            item.add_argument(
+                "-w",
+                "--where",
+                help=(
+                    "Apply to all items matching a filter in the form KEY[__OPERATOR]=VALUE "
+                    "instead of a single id. Repeat for several filters"
+                ),
+                action="append",
+                type=process_data,
+            )
+        q1.add_argument(
+            "-l", "--limit", help="How many rows to return, 0 for all", type=int, default=100,
+        )
+        q2.add_argument(
+            "-l", "--limit", help="How many rows to return, 0 for all", type=int, default=100,
+        )
         q1.add_argument("-o", "--offset", help="How many rows to offset", type=int, default=0)
         q2.add_argument("-o", "--offset", help="How many rows to offset", type=int, default=0)
+        for item in (q1, q2):
+            item.add_argument(
+                "-a",
+                "--after",
+                help="Continuation token printed by the previous page",
+            )
+            item.add_argument(
+                "--order-by",
+                help=(
+                    "Column to sort by, prefixed with - for descending order. Give descending "
+                    "columns with an equals sign, e.g. --order-by=-amount"
+                ),
+            )
+            item.add_argument(
+                "-e",
+                "--expand",
+                help="Comma-separated relationships to load and print, e.g. business,category",
+                type=process_list,
+            )
+            item.add_argument(
+                "-g",
+                "--group-by",
+                help="Comma-separated columns to group by, e.g. category_id,period_id",
+                type=process_list,
+            )
+            item.add_argument(
+                "--agg",
+                help="Comma-separated aggregates per group, e.g. sum:amount,count:id",
+                type=process_aggregates,
+            )
+            item.add_argument(
+                "-s",
+                "--stream",
+                help="Print rows as they are fetched instead of collecting them first",
+                action="store_true",
+            )
         return parser
 
     @classmethod
@@ -82,7 +245,10 @@ class Parser:
         parser = cls.add_objects_argument(parser)
         _ = parser.add_argument(
             "data",
-            help="Key-value pairs in the form KEY=VALUE",
+            help=(
+                "Key-value pairs in the form KEY=VALUE. Queries also accept KEY__OPERATOR=VALUE "
+                "with operators: eq, ne, gt, ge, lt, le, like, in, between, isnull"
+            ),
             nargs="*",
             type=process_data,
             default={},
@@ -0,0 +1,231 @@
+"""
+In-process caches of database lookups
+
+Caches are kept per engine so that separate databases never share cached values. They are
+dropped together with the engine
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+from typing import Any
+from uuid import uuid4
+from weakref import WeakKeyDictionary, ref
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded to `maxsize` items which evicts the least recently used item first.
+    Lookups are counted as hits and misses
+    """
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 1:
+            raise ValueError(f"Cache size must be positive: {maxsize}")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(size={len(self)}, maxsize={self.maxsize}, "
+            f"hits={self.hits}, misses={self.misses})"
+        )
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, items: dict):
+        for key, value in items.items():
+            self.set(key, value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class VersionedCache:
+    """
+    Thread-safe mapping of values kept with the data version they were read at. A value is only
+    returned for the same version and loaded again once the version changes. Lookups are counted as
+    hits and misses
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._data: dict[Hashable, tuple[tuple, Any]] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(size={len(self)}, hits={self.hits}, "
+            f"misses={self.misses})"
+        )
+
+    def get(self, key: Hashable, version: tuple, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load()
+        with self._lock:
+            self._data[key] = (version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DataVersion:
+    """
+    Version of the data in an SQLite database which changes after every commit. Commits of this
+    process through the engine are counted, commits of other processes are detected with
+    `PRAGMA data_version` on a connection kept for the purpose - the pragma is only comparable on
+    the same connection. Both restart with the process, so versions include a random token to stay
+    unique across restarts. Versions are local to the process - use them in cache keys only
+    """
+    def __init__(self, engine: Engine):
+        #   Weak since the per-engine caches must not keep the engine alive
+        self.engine = ref(engine)
+        self.token = uuid4().hex
+        self.commits = 0
+        self._connection = None
+        self._lock = Lock()
+        event.listen(engine, "commit", self._count)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(commits={self.commits})"
+
+    def _count(self, *args):
+        with self._lock:
+            self.commits += 1
+
+    def get(self) -> tuple[str, int, int]:
+        with self._lock:
+            if self._connection is None:
+                self._connection = self.engine().raw_connection()
+            cursor = self._connection.cursor()
+            try:
+                data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            finally:
+                cursor.close()
+            return self.token, data_version, self.commits
+
+    def clear(self):
+        """
+        Change the version, e.g. after a rolled back unit of work
+        """
+        self._count()
+
+
+_caches: WeakKeyDictionary[Engine, dict[str, Any]] = WeakKeyDictionary()
+_caches_lock = Lock()
+
+
+def get_cache(engine: Engine, name: str, factory: Callable[[], Any] = dict) -> Any:
+    """
+    Get the named cache of an engine, creating it with `factory` on first use. Concurrent first
+    uses get the same cache
+    """
+    caches = _caches.get(engine)
+    if caches is not None and name in caches:
+        return caches[name]
+
+    with _caches_lock:
+        caches = _caches.setdefault(engine, {})
+        if name not in caches:
+            caches[name] = factory()
+        return caches[name]
+
+
+def data_version(engine: Engine) -> tuple[str, int, int]:
+    """
+    Current data version of the database of an engine. Use it in cache keys of values derived from
+    the data
+    """
+    return get_cache(engine, "data_version", lambda: DataVersion(engine)).get()
+
+
+def lookups(engine: Engine) -> VersionedCache:
+    """
+    Reference data of an engine by table name, e.g. the accounts listed in report filters. Entries
+    are invalidated by any change of the data version only, which is shared by all processes
+    """
+    return get_cache(engine, "lookups", VersionedCache)
+
+
+def lookup(engine: Engine, table: str, load: Callable[[], Any]) -> Any:
+    """
+    Get reference data of a table from the lookup cache or load it if the data has changed since
+    """
+    return lookups(engine).get(table, data_version(engine), load)
+
+
+def pending(session: Session, cache: Any) -> dict:
+    """
+    Entries for a cache read or written in a session. They are added to the cache with its
+    `update` method when the session commits and dropped when it rolls back, since they may refer
+    to rows that were never saved
+    """
+    caches = session.info.setdefault("pending_caches", {})
+    if id(cache) not in caches:
+        caches[id(cache)] = (cache, {})
+    return caches[id(cache)][1]
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session):
+    for cache, entries in session.info.pop("pending_caches", {}).values():
+        cache.update(entries)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session: Session, previous_transaction):
+    session.info.pop("pending_caches", None)
+
+
+def clear_caches(engine: Engine):
+    """
+    Clear all caches of an engine, e.g. after a rolled back unit of work
+    """
+    with _caches_lock:
+        caches = list(_caches.get(engine, {}).values())
+    for cache in caches:
+        cache.clear()
@@ -1,12 +1,18 @@
 """
 Finance tracker main module
 """
+from collections import Counter
+from collections.abc import Iterator
+import csv
+import datetime as dt
+from functools import partial
 import logging
 from pathlib import Path
 from typing import Any
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 from finance_tracker.qr_handler import (
     create_capture,
@@ -15,13 +21,15 @@ from finance_tracker.qr_handler import (
 )
 from finance_tracker.managers import (
     AccountManager,
+    BaseManager,
     BusinessManager,
     CategoryManager,
     PeriodManager,
     SubcategoryManager,
     TransactionManager,
+    unit_of_work,
 )
-from finance_tracker.models import BaseModel
+from finance_tracker.models import SCHEMA_VERSION, BaseModel, TransactionAggregateModel
 
 logger = logging.getLogger(__name__)
 handler = logging.StreamHandler()
@@ -30,6 +38,24 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+def read_rows(path: Path, defaults: dict | None = None) -> list[dict]:
+    """
+    Read data items from a CSV file with a header of data keys. Empty cells are treated as missing
+    so that the defaults or derived values can be used instead
+    """
+    defaults = defaults or {}
+    with open(Path(path).expanduser(), newline="", encoding="utf-8") as cur_file:
+        result = [
+            {
+                **defaults,
+                **{key: value for key, value in row.items() if value not in (None, "")},
+            }
+            for row
+            in csv.DictReader(cur_file)
+        ]
+    return result
+
+
 def interact(prompt: str, choices: list[Any]) -> Any:
     """
     Ask the user a question, provide choices in a menu-like fashion numbering options and return the
@@ -54,6 +80,7 @@ def interact(prompt: str, choices: list[Any]) -> Any:
 class DBHandler:
     engine: Engine
     path: Path
+    profile: str
 
     paths = (
         Path("~/.config/finance_tracker/finance_tracker.db").expanduser(),
@@ -61,7 +88,45 @@ class DBHandler:
         Path("./finance_tracker.db").expanduser(),
     )
 
-    def __init__(self, path: Path = None):
+    #   SQLite pragmas applied to every new connection. WAL lets the report server read while the
+    #   command line writes. "fast" trades durability of the last commits on power loss for speed
+    profiles = {
+        "safe": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "foreign_keys": "ON",
+            "busy_timeout": 5000,
+        },
+        "fast": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "foreign_keys": "ON",
+            "busy_timeout": 5000,
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+    }
+    #   Data migrations to each schema version, applied in order to databases of older versions
+    migrations = {
+        #   Amounts in integer cents
+        1: 'UPDATE "transaction" SET amount = CAST(ROUND(amount * 100) AS INTEGER)',
+        #   Monthly rollup of existing transactions
+        2: (
+            "INSERT INTO transaction_aggregate (period_id, account_id, account_for_id, "
+            "category_id, subcategory_id, business_id, amount, count) "
+            "SELECT period_id, account_id, account_for_id, category_id, subcategory_id, "
+            'business_id, SUM(amount), COUNT(*) FROM "transaction" '
+            "GROUP BY period_id, account_id, account_for_id, category_id, subcategory_id, "
+            "business_id"
+        ),
+    }
+
+    def __init__(self, path: Path = None, profile: str = "safe"):
+        if profile not in self.profiles:
+            raise ValueError(f"Invalid database profile: {profile}")
+
+        self.profile = profile
         if path:
             path = Path(path).expanduser()
 
@@ -83,6 +148,7 @@ class DBHandler:
         print(f"Using path: {path}")
         self.path = path
         self.engine = self.create_engine(path)
+        self.upgrade_schema(self.engine)
 
     def check_standard_paths(self):
         return next((item for item in self.paths if item.exists()), None)
@@ -98,27 +164,110 @@ class DBHandler:
 
         return path
 
-    def create_engine(self, path: Path):
+    def create_engine(self, path: Path) -> Engine:
         engine = create_engine(f"sqlite+pysqlite:///{str(path)}")
+        pragmas = self.profiles[self.profile]
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            for key, value in pragmas.items():
+                cursor.execute(f"PRAGMA {key} = {value}")
+            cursor.close()
+
         return engine
 
+    @classmethod
+    def upgrade_schema(cls, engine: Engine):
+        """
+        Bring an existing database up to date with the models in place: create missing tables and
+        missing indexes of existing tables and migrate data of older schema versions. Older
+        databases may violate foreign keys, e.g. with transactions of deleted businesses, so
+        migrations run without foreign key checks and violations are reported afterwards
+        """
+        BaseModel.metadata.create_all(engine)
+        for table in BaseModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+
+        with engine.connect() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            if version >= SCHEMA_VERSION:
+                return
+
+            #   Only takes effect outside of a transaction
+            foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.commit()
+            try:
+                for number in sorted(cls.migrations):
+                    if number > version:
+                        logger.info(f"Migrating database to schema version {number}")
+                        conn.exec_driver_sql(cls.migrations[number])
+                conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                conn.commit()
+            finally:
+                conn.rollback()
+                conn.exec_driver_sql(f"PRAGMA foreign_keys = {foreign_keys}")
+                conn.commit()
+
+            violations = conn.exec_driver_sql("PRAGMA foreign_key_check").all()
+            counts = Counter((table, parent) for table, _, parent, _ in violations)
+            for (table, parent), count in counts.items():
+                logger.warning(f"{count} rows of {table} refer to missing {parent} rows")
+
     @staticmethod
     def initial_setup(engine: Engine):
         from finance_tracker.default_data import category, subcategory, account
-        _ = [AccountManager(engine).create(**data) for data in account]
-        ex_cat = {
-            data["name"]: CategoryManager(engine).create(**data).id
-            for data
-            in category
-        }
-        [
-            SubcategoryManager(engine).create(
-                **data, category_id=category_id,
+        with unit_of_work(engine) as sess:
+            _ = [AccountManager(engine, session=sess).create(**data) for data in account]
+            ex_cat = {
+                data["name"]: CategoryManager(engine, session=sess).create(**data).id
+                for data
+                in category
+            }
+            SubcategoryManager(engine, session=sess).create_many(
+                {**data, "category_id": category_id}
+                for item, category_id
+                in ex_cat.items()
+                for data in subcategory[item]
             )
-            for item, category_id
-            in ex_cat.items()
-            for data in subcategory[item]
-        ]
+
+
+def run_report(args, db_handler: DBHandler):
+    """
+    Run the report server: the development server by default or the production server with
+    `--workers`. The schema is upgraded before any worker starts
+    """
+    #   TODO: use conditional imports since finance_tracker[report] might not be
+    #   installed
+    from finance_tracker.report.app import create_app, start_warm_up
+    from finance_tracker.report.server import serve, split_bind
+
+    #   Workers create their own engines, none of the connections of this one are inherited
+    db_handler.engine.dispose()
+    app = create_app(
+        partial(db_handler.create_engine, db_handler.path),
+        render_workers=getattr(args, "render_workers", 0),
+    )
+    bind = getattr(args, "bind", "127.0.0.1:5000")
+    warm_up_periods = getattr(args, "warm_up", 0)
+    on_start = partial(start_warm_up, app, warm_up_periods) if warm_up_periods else None
+    workers = getattr(args, "workers", 0)
+    if workers:
+        serve(
+            app,
+            bind=bind,
+            workers=workers,
+            threads=getattr(args, "threads", 4),
+            on_start=on_start,
+        )
+        return
+
+    host, port = split_bind(bind)
+    if on_start:
+        on_start()
+    app.run(host=host, port=port, debug=args.verbose)
 
 
 def main(args):
@@ -129,18 +278,29 @@ def main(args):
     2. object - what to apply the action to
     """
     logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
-    db_handler = DBHandler(path=args.database)
+    db_handler = DBHandler(path=args.database, profile=getattr(args, "db_profile", "safe"))
 
     if args.action == "report":
-        #   TODO: extract into a separate function
-        #   TODO: use conditional imports since finance_tracker[report] might not be
-        #   installed
-        from finance_tracker.report.app import app
-
-        app.config.engine = db_handler.engine
-        app.run(debug=args.verbose)
+        run_report(args, db_handler)
         return
 
+    if args.action == "explain":
+        from finance_tracker.report.summary import SummaryMetrics
+
+        with Session(db_handler.engine) as sess:
+            #   Plans do not depend on the data - use a placeholder period on an empty database
+            empty = sess.scalar(select(TransactionAggregateModel.id).limit(1)) is None
+            placeholder = {"period_id": 0, "period": dt.date.today().replace(day=1)}
+            plans = SummaryMetrics(sess, **(placeholder if empty else {})).explain()
+
+        print("\n\n".join(f"{name}:\n" + "\n".join(plan) for name, plan in plans.items()))
+        return plans
+
+    if args.action == "rebuild-aggregates":
+        result = TransactionManager(db_handler.engine).refresh_aggregates()
+        print(f"Rebuilt {result} aggregate rows")
+        return result
+
     args.object = (
         args.object[0]
         if isinstance(args.object, list)
@@ -171,19 +331,63 @@ def main(args):
         case _:
             raise ValueError(f"Invalid object: {args.object}")
 
-    manager = manager(db_handler.engine)
+    if args.action in ("help", "h"):
+        fields = {
+            item.name: item.type
+            for item
+            in manager.model.__table__.c
+            if item.name not in dir(BaseModel)
+        }
+        print(f"{args.object} possible data: {fields}")
+        return
+
+    #   All steps of an action share one session and are committed once
+    with unit_of_work(db_handler.engine) as sess:
+        manager = manager(db_handler.engine, session=sess)
+        result = run_action(args, manager)
+
+        count, last = 0, None
+        if isinstance(result, Iterator):
+            #   Write streamed rows while the session is still open
+            for last in result:
+                print(last)
+                count += 1
+            result = count
+        elif isinstance(result, list):
+            count, last = len(result), (result[-1] if result else None)
+            print("\n".join(str(item) for item in result))
+        else:
+            print(result)
+
+    logger.info(f"Business lookup cache: {BusinessManager(db_handler.engine).cache}")
 
+    if (
+        args.action in ("query", "q")
+        and isinstance(last, BaseModel)
+        and count == args.limit
+    ):
+        token = manager.page_token(
+            last,
+            order_by=getattr(args, "order_by", None),
+            after=getattr(args, "after", None),
+        )
+        print(f"Next page: --after {token}")
+    return result
+
+
+def run_action(args, manager: BaseManager):
+    """
+    Apply the action from the parsed arguments using a manager
+    """
+    where = {
+        key: value
+        for item in getattr(args, "where", None) or []
+        for key, value
+        in item.items()
+    }
     match args.action:
-        case "help" | "h":
-            fields = {
-                item.name: item.type
-                for item
-                in manager.model.__table__.c
-                if item.name not in dir(BaseModel)
-            }
-            print(f"{args.object} possible data: {fields}")
-            return
         case "create" | "c":
+            on_conflict = getattr(args, "on_conflict", None)
             if args.qr_code:
                 if args.object not in ["business", "b", "transaction", "t"]:
                     raise ValueError(
@@ -191,23 +395,50 @@ def main(args):
                     )
                 capture = create_capture()
                 qrdata = QRData.from_string(get_qr_from_video(capture))
-                result = manager.from_qr_code(qrdata, **args.data)
+                result = manager.from_qr_code(qrdata, on_conflict=on_conflict, **args.data)
+            elif getattr(args, "file", None):
+                rows = read_rows(args.file, defaults=args.data)
+                result = manager.create_many(
+                    rows,
+                    batch_size=getattr(args, "batch_size", 500),
+                    on_conflict=on_conflict,
+                )
+            elif on_conflict:
+                result = manager.upsert(on_conflict, **args.data)
             else:
                 result = manager.create(**args.data)
         case "get" | "g":
             result = manager.get(**args.data)
+        case "update" | "u" if where:
+            if not args.data:
+                raise ValueError("Nothing to update, give KEY=VALUE pairs to set")
+            result = manager.update_many(where, args.data)
         case "update" | "u":
             result = manager.update(**args.data)
+        case "delete" | "d" if where:
+            result = manager.delete_many(where)
         case "delete" | "d":
             result = manager.delete(**args.data)
+        case "query" | "q" if getattr(args, "group_by", None) or getattr(args, "agg", None):
+            result = manager.query(
+                args.limit,
+                args.offset,
+                order_by=getattr(args, "order_by", None),
+                group_by=args.group_by,
+                aggregates=args.agg,
+                **args.data,
+            )
         case "query" | "q":
-            result = manager.query(args.limit, args.offset, **args.data)
+            method = manager.stream if getattr(args, "stream", False) else manager.query
+            result = method(
+                args.limit,
+                args.offset,
+                after=getattr(args, "after", None),
+                order_by=getattr(args, "order_by", None),
+                expand=getattr(args, "expand", None),
+                **args.data,
+            )
         case _:
             raise ValueError(f"Invalid action: {args.action}")
 
-    print(
-        "\n".join(str(item) for item in result)
-        if isinstance(result, list)
-        else result
-    )
     return result
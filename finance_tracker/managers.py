@@ -3,16 +3,32 @@ Application logic - managers
 """
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+import base64
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 import datetime as dt
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import json
 import logging
+from typing import Self
 
-from sqlalchemy import select
-from sqlalchemy.engine import Engine
+from sqlalchemy import Insert, Select, and_, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, RowMapping
+from sqlalchemy.sql.expression import ColumnElement
 from sqlalchemy.orm import (
     Session,
+    joinedload,
 )
 
+from finance_tracker.cache import (
+    LRUCache,
+    clear_caches,
+    get_cache,
+    pending,
+)
 from finance_tracker.models import (
     BaseModel,
     AccountModel,
@@ -20,6 +36,7 @@ from finance_tracker.models import (
     CategoryModel,
     SubcategoryModel,
     PeriodModel,
+    TransactionAggregateModel,
     TransactionModel,
 )
 from finance_tracker.qr_handler import (
@@ -29,95 +46,628 @@ from finance_tracker.qr_handler import (
 logger = logging.getLogger(__name__)
 
 
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Split an iterable into lists of at most `size` items
+    """
+    if size < 1:
+        raise ValueError(f"Batch size must be positive: {size}")
+
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+@contextmanager
+def unit_of_work(engine: Engine) -> Iterator[Session]:
+    """
+    Open a session that can be shared by several managers and commit it once on exit. The session
+    is rolled back if an error is raised. Closing a generator that uses the session early, e.g. a
+    stream, is a normal exit
+    """
+    with Session(engine, expire_on_commit=False) as sess:
+        try:
+            yield sess
+            sess.commit()
+        except GeneratorExit:
+            sess.commit()
+            raise
+        except BaseException:
+            sess.rollback()
+            #   Cached ids may refer to rows that were never committed
+            clear_caches(engine)
+            raise
+
+
 @dataclass
 class BaseManager(ABC):
     """
     Base object manager that should be inherited by other objects
 
     Args:
-        sess: current SQLAlchemy session
+        engine: SQLAlchemy engine
+        session: optional session to bind the manager to. Operations of bound managers share the
+            session and are only flushed - the owner of the session commits. Unbound managers open
+            a new unit of work per operation
     """
     engine: Engine
+    session: Session | None = None
+    #   Columns filled in by `_prepare` from other columns. Upserts overwrite them only when one of
+    #   their sources is given
+    derived_columns = {}
 
     @property
     @abstractmethod
     def model(self) -> BaseModel:
         pass
 
+    def bind(self, session: Session) -> Self:
+        """
+        Return a copy of the manager bound to a session
+        """
+        return replace(self, session=session)
+
+    def _manager(self, manager: type["BaseManager"]) -> "BaseManager":
+        """
+        Create another manager sharing the engine and session of this one
+        """
+        return manager(self.engine, session=self.session)
+
+    @contextmanager
+    def _bound(self) -> Iterator[Self]:
+        """
+        Yield a manager bound to a session: either this manager if it is already bound or a copy
+        bound to a new unit of work
+        """
+        if self.session is not None:
+            yield self
+            return
+
+        with unit_of_work(self.engine) as sess:
+            yield self.bind(sess)
+
+    def _prepare(self, data: dict) -> dict:
+        """
+        Fill in derived values before an observation is created. Override in child classes
+        """
+        return data
+
+    def _invalidate(self):
+        """
+        Drop cached values before observations are written. Override in child classes with caches
+        """
+
     def get(self, id: int) -> BaseModel:
-        with Session(self.engine) as sess:
-            result = sess.get(self.model, id)
+        with self._bound() as manager:
+            result = manager.session.get(self.model, id)
         return result
 
     def create(self, **data) -> BaseModel:
-        new = self.model(**data)
-        with Session(self.engine) as sess:
-            sess.add(new)
-            sess.commit()
-            # Silently select?
-            _ = new.id
+        self._invalidate()
+        with self._bound() as manager:
+            data = manager._prepare(data)
+            new = self.model(**data)
+            manager.session.add(new)
+            manager.session.flush()
         return new
 
+    def _update_keys(self, keys: Iterable[str]) -> list[str]:
+        """
+        Columns that an upsert of rows with the given keys overwrites: the given columns and the
+        columns derived from them. Defaults filled in by `_prepare` are left as they are
+        """
+        keys = list(keys)
+        derived = [
+            key
+            for key, sources in self.derived_columns.items()
+            if key not in keys and set(sources) & set(keys)
+        ]
+        return keys + derived
+
+    def _upsert_query(self, keys: Iterable[str], on_conflict: str) -> Insert:
+        """
+        Build an INSERT ... ON CONFLICT(code) statement. Updates overwrite the given columns
+        """
+        code = self.model.__table__.c.get("code")
+        if code is None or not code.unique:
+            raise ValueError(f"Upsert needs a unique code: {self.model.__tablename__}")
+
+        query = sqlite_insert(self.model)
+        match on_conflict:
+            case "update":
+                immutable_columns = BaseModel.__annotations__.keys()
+                values = {
+                    key: query.excluded[key]
+                    for key in keys
+                    if key not in immutable_columns and key != "code"
+                }
+                query = query.on_conflict_do_update(
+                    index_elements=[code],
+                    set_={**values, "updated_time": func.now()},
+                )
+            case "nothing":
+                query = query.on_conflict_do_nothing(index_elements=[code])
+            case _:
+                raise ValueError(f"Invalid conflict action: {on_conflict}")
+        return query
+
+    def create_many(
+        self,
+        rows: Iterable[dict],
+        batch_size: int = 500,
+        on_conflict: str | None = None,
+    ) -> list[int]:
+        """
+        Create many observations in a single transaction. Rows are inserted in batches of
+        `batch_size` using executemany-style statements. Return the ids of the new observations in
+        the order of the input rows
+
+        Args:
+            on_conflict: for models with a unique code - "update" existing observations with the
+                same code or do "nothing". Each batch is a single statement, so the returned ids
+                are not guaranteed to follow the input order. Ids of ignored rows are not returned
+        """
+        self._invalidate()
+        query = insert(self.model).returning(self.model.id, sort_by_parameter_order=True)
+        result = []
+        with self._bound() as manager:
+            for batch in batched(rows, batch_size):
+                batch = [(tuple(row), manager._prepare(dict(row))) for row in batch]
+                if not on_conflict:
+                    result.extend(manager.session.scalars(query, [row for _, row in batch]).all())
+                    continue
+
+                #   Rows with the same given and prepared keys share a statement
+                groups = {}
+                for given, row in batch:
+                    groups.setdefault((given, tuple(row)), []).append(row)
+                for (given, _), group in groups.items():
+                    upsert = self._upsert_query(self._update_keys(given), on_conflict)
+                    upsert = upsert.returning(self.model.id)
+                    result.extend(manager.session.scalars(upsert, group).all())
+
+        logger.info(f"Created {len(result)} {self.model.__tablename__} rows")
+        return result
+
+    def upsert(self, on_conflict: str = "update", **data) -> BaseModel:
+        """
+        Create an observation or, if one with the same code exists, update it or leave it as is
+        """
+        with self._bound() as manager:
+            ids = manager.create_many([data], on_conflict=on_conflict)
+            if ids:
+                #   Bulk statements bypass the identity map so refresh any loaded copy
+                return manager.session.get(self.model, ids[0], populate_existing=True)
+            return manager.query(limit=1, code=data["code"])[0]
+
     def delete(self, id: int) -> BaseModel:
         """
         Delete an observation and return its previous values
         """
-        with Session(self.engine) as sess:
-            result = self.get(id)
-            sess.delete(result)
-            sess.commit()
+        self._invalidate()
+        with self._bound() as manager:
+            result = manager.session.get(self.model, id)
+            manager.session.delete(result)
+            manager.session.flush()
         return result
 
     def update(self, id: int, **data) -> BaseModel:
         immutable_columns = BaseModel.__annotations__.keys()
-        with Session(self.engine) as sess:
-            item = self.get(id)
+        self._invalidate()
+        with self._bound() as manager:
+            item = manager.session.get(self.model, id)
             for key, value in data.items():
                 if key in immutable_columns:
                     logger.warning(f"Key is immutable: {key}")
                     continue
                 item.__setattr__(key, value)
 
-            sess.add(item)
-            sess.commit()
+            manager.session.flush()
+        return item
 
-        result = self.get(id)
+    def _where(self, filters: dict) -> list[ColumnElement[bool]]:
+        """
+        Compile filters for set-based writes. At least one filter is needed to avoid changing all
+        rows by mistake
+        """
+        if not filters:
+            raise ValueError("At least one filter is needed, e.g. id__gt=0 for all rows")
+        return [self._filter(key, value) for key, value in filters.items()]
+
+    def update_many(self, filters: dict, values: dict) -> int:
+        """
+        Update all observations matching the filters with a single statement. Filters use the same
+        syntax as `query`. Return the number of updated rows
+        """
+        immutable_columns = BaseModel.__annotations__.keys()
+        for key in values:
+            if key not in self.model.__table__.c:
+                raise ValueError(f"Invalid column: {key}")
+            if key in immutable_columns:
+                logger.warning(f"Key is immutable: {key}")
+
+        values = {
+            key: self._coerce(key, value)
+            for key, value in values.items()
+            if key not in immutable_columns
+        }
+        if not values:
+            raise ValueError("Nothing to update, give values of mutable columns")
+
+        self._invalidate()
+        query = (
+            update(self.model)
+            .where(*self._where(filters))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        with self._bound() as manager:
+            result = manager.session.execute(query).rowcount
+
+        logger.info(f"Updated {result} {self.model.__tablename__} rows")
+        return result
+
+    def delete_many(self, filters: dict) -> int:
+        """
+        Delete all observations matching the filters with a single statement. Filters use the same
+        syntax as `query`. Return the number of deleted rows
+        """
+        self._invalidate()
+        query = (
+            delete(self.model)
+            .where(*self._where(filters))
+            .execution_options(synchronize_session=False)
+        )
+        with self._bound() as manager:
+            result = manager.session.execute(query).rowcount
+
+        logger.info(f"Deleted {result} {self.model.__tablename__} rows")
+        return result
+
+    filter_operators = {
+        "eq": lambda column, value: column == value,
+        "ne": lambda column, value: column != value,
+        "gt": lambda column, value: column > value,
+        "ge": lambda column, value: column >= value,
+        "lt": lambda column, value: column < value,
+        "le": lambda column, value: column <= value,
+        "like": lambda column, value: column.like(value),
+        "in": lambda column, values: column.in_(values),
+        "between": lambda column, values: column.between(*values),
+        "isnull": lambda column, value: column.is_(None) if value else column.is_not(None),
+    }
+
+    aggregate_functions = {
+        "sum": func.sum,
+        "count": func.count,
+        "min": func.min,
+        "max": func.max,
+        #   Typed like the column so averages of stored cents are converted back
+        "avg": lambda column: func.avg(column, type_=column.type),
+    }
+
+    def _filter(self, key: str, value) -> ColumnElement[bool]:
+        """
+        Compile a filter in the form `column__operator=value` to an SQL predicate. The operator
+        defaults to equality. Values of the "in" and "between" operators are comma-separated if
+        given as text
+        """
+        name, operator = key.rsplit("__", 1) if "__" in key else (key, "eq")
+        if operator not in self.filter_operators:
+            raise ValueError(f"Invalid filter operator: {operator}")
+        if name not in self.model.__table__.c:
+            raise ValueError(f"Invalid filter column: {name}")
+
+        column = self.model.__table__.c[name]
+        match operator:
+            case "in" | "between":
+                values = value.split(",") if isinstance(value, str) else list(value)
+                value = [self._coerce(name, item) for item in values]
+                if operator == "between" and len(value) != 2:
+                    raise ValueError(f"Between needs two values: {key}={value}")
+            case "isnull":
+                value = str(value).casefold() in ("1", "true", "yes")
+            case "like":
+                pass
+            case _:
+                value = self._coerce(name, value)
+        return self.filter_operators[operator](column, value)
+
+    def _coerce(self, key: str, value):
+        """
+        Convert a value, e.g. text from the command line, to the Python type of a column
+        """
+        python_type = self.model.__table__.c[key].type.python_type
+        if value is None or isinstance(value, python_type):
+            return value
+        try:
+            if python_type in (dt.date, dt.datetime):
+                return python_type.fromisoformat(value)
+            return python_type(value)
+        except (ValueError, InvalidOperation) as e:
+            raise ValueError(f"Invalid value of {key}: {value}") from e
+
+    @staticmethod
+    def encode_token(order_by: str, value, id: int) -> str:
+        """
+        Create an opaque continuation token pointing after an observation
+        """
+        value = value.isoformat() if isinstance(value, (dt.date, dt.datetime)) else value
+        value = str(value) if isinstance(value, Decimal) else value
+        data = json.dumps({"order_by": order_by, "value": value, "id": id})
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_token(token: str) -> dict:
+        try:
+            result = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+            _ = result["order_by"], result["value"], result["id"]
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"Invalid continuation token: {token}") from e
         return result
 
+    def _resolve_order(self, order_by: str | None, after: str | None) -> tuple[str, dict | None]:
+        """
+        Get the sort order and the decoded continuation token. The order of the token is used if
+        no order is given
+        """
+        cursor = self.decode_token(after) if after else None
+        if cursor and order_by and cursor["order_by"] != order_by:
+            raise ValueError(f"Token is for order {cursor['order_by']}, not {order_by}")
+
+        order_by = order_by or (cursor["order_by"] if cursor else "id")
+        if order_by.lstrip("-") not in self.model.__table__.c:
+            raise ValueError(f"Invalid sort column: {order_by}")
+        return order_by, cursor
+
+    def _keyset(self, order_by: str, cursor: dict) -> ColumnElement[bool]:
+        """
+        Filter for the rows after a cursor in the given order. Ties are broken by id. NULL values
+        come first in ascending and last in descending order in SQLite
+        """
+        key = order_by.lstrip("-")
+        descending = order_by.startswith("-")
+        column = self.model.__table__.c[key]
+        id_column = self.model.__table__.c.id
+        value = self._coerce(key, cursor["value"])
+        after_id = id_column < cursor["id"] if descending else id_column > cursor["id"]
+
+        if key == "id":
+            return after_id
+        if value is None:
+            return (
+                and_(column.is_(None), after_id)
+                if descending
+                else or_(column.is_not(None), and_(column.is_(None), after_id))
+            )
+        return or_(
+            column < value if descending else column > value,
+            and_(column == value, after_id),
+            *([column.is_(None)] if descending else []),
+        )
+
+    def page_token(
+        self,
+        item: BaseModel,
+        order_by: str | None = None,
+        after: str | None = None,
+    ) -> str:
+        """
+        Get the continuation token for the page after an observation
+        """
+        order_by, _ = self._resolve_order(order_by, after)
+        return self.encode_token(order_by, getattr(item, order_by.lstrip("-")), item.id)
+
+    def _select(
+        self,
+        offset: int = 0,
+        after: str | None = None,
+        order_by: str | None = None,
+        expand: list[str] | None = None,
+        **kwargs,
+    ) -> Select:
+        """
+        Build the query for `query` and `stream`
+        """
+        order_by, cursor = self._resolve_order(order_by, after)
+        sort_key = order_by.lstrip("-")
+        columns = [self.model.__table__.c[item] for item in dict.fromkeys([sort_key, "id"])]
+        relationships = self.model.__mapper__.relationships
+        for item in expand or []:
+            if item not in relationships:
+                raise ValueError(f"Invalid relationship: {item}")
+
+        #   All relationships are many-to-one so joining them keeps a single query
+        query = select(self.model).options(
+            *(joinedload(relationships[item]) for item in expand or [])
+        )
+
+        for key, value in kwargs.items():
+            query = query.where(self._filter(key, value))
+
+        if cursor:
+            query = query.where(self._keyset(order_by, cursor))
+
+        query = query.order_by(
+            *(item.desc() if order_by.startswith("-") else item for item in columns)
+        )
+        query = query.offset(offset)
+        return query
+
+    def _aggregate_select(
+        self,
+        group_by: list[str],
+        aggregates: list[tuple[str, str]],
+        offset: int = 0,
+        order_by: str | None = None,
+        **kwargs,
+    ) -> Select:
+        """
+        Build an aggregation query. Aggregate columns are labelled `<function>_<column>`
+        """
+        table = self.model.__table__
+        for item in [*group_by, *(column for _, column in aggregates)]:
+            if item not in table.c:
+                raise ValueError(f"Invalid column: {item}")
+        for function, _ in aggregates:
+            if function not in self.aggregate_functions:
+                raise ValueError(f"Invalid aggregate function: {function}")
+
+        groups = [table.c[item] for item in group_by]
+        columns = [
+            *groups,
+            *(
+                self.aggregate_functions[function](table.c[column]).label(f"{function}_{column}")
+                for function, column in aggregates
+            ),
+        ]
+        labels = {item.name: item for item in columns}
+        if order_by and order_by.lstrip("-") not in labels:
+            raise ValueError(f"Invalid sort column: {order_by}")
+
+        query = select(*columns).select_from(table).group_by(*groups)
+        for key, value in kwargs.items():
+            query = query.where(self._filter(key, value))
+
+        if order_by:
+            column = labels[order_by.lstrip("-")]
+            query = query.order_by(column.desc() if order_by.startswith("-") else column)
+        else:
+            query = query.order_by(*groups)
+        return query.offset(offset)
+
     def query(
         self,
         limit: int = 100,
         offset: int = 0,
+        after: str | None = None,
+        order_by: str | None = None,
+        expand: list[str] | None = None,
+        group_by: list[str] | None = None,
+        aggregates: list[tuple[str, str]] | None = None,
         **kwargs,
-    ) -> list[BaseModel]:
-        with Session(self.engine) as sess:
-            query = select(self.model)
-
-            for key, value in kwargs.items():
-                query = query.where(self.model.__dict__[key] == value)
+    ) -> list[BaseModel] | list[RowMapping]:
+        """
+        Query observations in a stable order. Pages can be requested either by offset or, more
+        efficiently, with a continuation token from `page_token` passed as `after`
+
+        Args:
+            limit: maximum number of rows, 0 for all rows
+            order_by: sort column, prefixed with "-" for descending order. Defaults to id
+            expand: relationships to load together with the observations, e.g. ["business"]
+            group_by: columns to group by in the database. Rows are returned as mappings
+            aggregates: pairs of (function, column) to compute per group, e.g. ("sum", "amount").
+                Functions: sum, count, min, max, avg
+            kwargs: filters in the form `column__operator=value`, e.g. `amount__gt=100`. Operators:
+                eq (default), ne, gt, ge, lt, le, like, in, between, isnull
+        """
+        if group_by or aggregates:
+            if after:
+                raise ValueError("Continuation tokens are not supported for aggregations")
 
-            query = query.offset(offset)
+            query = self._aggregate_select(
+                group_by or [], aggregates or [], offset, order_by=order_by, **kwargs,
+            )
+            query = query.limit(limit) if limit else query
+            with self._bound() as manager:
+                return manager.session.execute(query).mappings().all()
 
-            result = sess.execute(query).fetchmany(limit)
-            #   Unpack from single-length tuples
-            result = [item[0] for item in result]
+        query = self._select(offset, after=after, order_by=order_by, expand=expand, **kwargs)
+        query = query.limit(limit) if limit else query
+        with self._bound() as manager:
+            result = manager.session.scalars(query).all()
 
         return result
 
+    def stream(
+        self,
+        limit: int = 0,
+        offset: int = 0,
+        after: str | None = None,
+        order_by: str | None = None,
+        expand: list[str] | None = None,
+        batch_size: int = 1000,
+        **kwargs,
+    ) -> Iterator[BaseModel]:
+        """
+        Same as `query` but yield observations as they are fetched in batches of `batch_size` so
+        that memory use does not depend on the number of rows. The session stays open until the
+        generator is exhausted or closed
+        """
+        query = self._select(offset, after=after, order_by=order_by, expand=expand, **kwargs)
+        query = query.limit(limit) if limit else query
+        with self._bound() as manager:
+            yield from manager.session.scalars(query.execution_options(yield_per=batch_size))
+
 
 class AccountManager(BaseManager):
     model = AccountModel
 
 
+@dataclass(frozen=True)
+class BusinessDefaults:
+    """
+    Business values needed to fill in transactions
+    """
+    id: int
+    code: str
+    default_category_id: int
+    default_subcategory_id: int
+
+
 class BusinessManager(BaseManager):
+    """
+    Business defaults are cached by business code and id since the same few businesses are
+    looked up for most transactions. Defaults are cached once their unit of work commits
+    """
     model = BusinessModel
+    cache_size = 256
 
-    def from_qr_code(self, qrdata: QRData, **data):
+    @property
+    def cache(self) -> LRUCache:
+        return get_cache(self.engine, "business", lambda: LRUCache(self.cache_size))
+
+    def lookup(self, id: int | None = None, code: str | None = None) -> BusinessDefaults | None:
+        """
+        Get the defaults of a business by id or code
+        """
+        key = ("id", int(id)) if id is not None else ("code", code)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        with self._bound() as manager:
+            new = pending(manager.session, self.cache)
+            if key in new:
+                return new[key]
+
+            business = (
+                manager.get(int(id))
+                if id is not None
+                else next(iter(manager.query(code=code)), None)
+            )
+            if business is None:
+                return None
+
+            result = BusinessDefaults(
+                id=business.id,
+                code=business.code,
+                default_category_id=business.default_category_id,
+                default_subcategory_id=business.default_subcategory_id,
+            )
+            new[("id", result.id)] = result
+            new[("code", result.code)] = result
+        return result
+
+    def _invalidate(self):
+        self.cache.clear()
+
+    def from_qr_code(self, qrdata: QRData, on_conflict: str | None = None, **data):
         data = {
             "code": qrdata.business_code,
             **data,
         }
-        return self.create(**data)
+        return self.upsert(on_conflict, **data) if on_conflict else self.create(**data)
 
 
 class CategoryManager(BaseManager):
@@ -129,10 +679,74 @@ class SubcategoryManager(BaseManager):
 
 
 class PeriodManager(BaseManager):
+    """
+    Periods are calendar months. Period ids are cached by period start since they are looked up
+    for every transaction. Ids are cached once their unit of work commits
+    """
     model = PeriodModel
 
-    def create(self, **data):
+    @property
+    def cache(self) -> dict[dt.date, int]:
+        return get_cache(self.engine, "period")
+
+    @staticmethod
+    def month_start(date: dt.date) -> dt.date:
+        return dt.date(date.year, date.month, 1)
+
+    def get_period_id(self, period_start: dt.date) -> int:
+        """
+        Get the id of the period starting on the given date, creating the period if needed
+        """
+        if period_start in self.cache:
+            return self.cache[period_start]
+
+        with self._bound() as manager:
+            new = pending(manager.session, self.cache)
+            if period_start not in new:
+                period = manager.query(period_start=period_start)
+                period = period[0] if period else manager.create(period_start=period_start)
+                new[period_start] = period.id
+            result = new[period_start]
+        return result
+
+    def ensure_periods(self, start: dt.date, end: dt.date) -> dict[dt.date, int]:
+        """
+        Make sure that a period exists for every month between two dates using one select and at
+        most one batched insert. Return the period ids by period start
+        """
+        months = []
+        month = self.month_start(start)
+        while month <= end:
+            months.append(month)
+            month = (month + dt.timedelta(days=32)).replace(day=1)
+
+        with self._bound() as manager:
+            query = (
+                select(PeriodModel.period_start, PeriodModel.id)
+                .where(PeriodModel.period_start.in_(months))
+            )
+            result = dict(manager.session.execute(query).all())
+            missing = [item for item in months if item not in result]
+            ids = manager.create_many({"period_start": item} for item in missing)
+            result.update(zip(missing, ids))
+            result = {item: result[item] for item in months}
+            pending(manager.session, self.cache).update(result)
+
+        return result
+
+    def _invalidate(self):
+        self.cache.clear()
+
+    def create(self, **data) -> BaseModel:
+        with self._bound() as manager:
+            result = super(PeriodManager, manager).create(**data)
+            pending(manager.session, self.cache)[result.period_start] = result.id
+        return result
+
+    def _prepare(self, data: dict) -> dict:
         period_start: dt.date = data.get("period_start") or dt.date.today().replace(day=1)
+        if isinstance(period_start, str):
+            period_start = dt.date.fromisoformat(period_start)
 
         if period_start.month == 12:
             period_end = (
@@ -145,46 +759,37 @@ class PeriodManager(BaseManager):
         data["period_start"] = period_start
         data["period_end"] = period_end
         data["code"] = period_start.strftime("%Y%m")
-        return super().create(**data)
+        return data
 
 
 class TransactionManager(BaseManager):
     model = TransactionModel
+    derived_columns = {"period_id": ("transaction_date",)}
     #   TODO: this needs to be cancellable:
     #   1. Disable delete
     #   2. Cancelling a transaction creates a new transaction for the negative sum
 
-    def create(self, **data):
+    def _prepare(self, data: dict) -> dict:
         """
         Handle dates if they are not given
         """
+        if isinstance(data.get("transaction_date"), str):
+            data["transaction_date"] = dt.date.fromisoformat(data["transaction_date"])
+
         #   Handle periods
         if not data.get("period_id"):
 
             #   Get or create the period corresponding to the transaction date or today
-            period_manager = PeriodManager(self.engine)
-
             if data.get("transaction_date"):
                 logger.info(f"Using period for date: {data['transaction_date']}")
-                transaction_date = dt.date.fromisoformat(data["transaction_date"])
-                data["transaction_date"] = transaction_date
-                period_start = dt.date(
-                   transaction_date.year,
-                   transaction_date.month,
-                   1,
-                )
+                transaction_date = data["transaction_date"]
             else:
                 logger.info("Using period for today")
-                period_start = None
+                transaction_date = dt.date.today()
 
-            period = period_manager.query(
-                period_start=period_start,
-            )
-            period = period[0] if period else None
-            if not period:
-                period = period_manager.create(period_start=period_start)  # Today
-
-            data["period_id"] = period.id
+            period_manager = self._manager(PeriodManager)
+            period_start = period_manager.month_start(transaction_date)
+            data["period_id"] = period_manager.get_period_id(period_start)
 
         #   Use business categories if not given
         if (
@@ -194,8 +799,7 @@ class TransactionManager(BaseManager):
                 or not data.get("subcategory_id")
             )
         ):
-            business_manager = BusinessManager(self.engine)
-            business = business_manager.get(data.get("business_id"))
+            business = self._manager(BusinessManager).lookup(id=data["business_id"])
             data["category_id"] = data.get("category_id", business.default_category_id)
             data["subcategory_id"] = data.get("subcategory_id", business.default_subcategory_id)
 
@@ -203,40 +807,148 @@ class TransactionManager(BaseManager):
         if not data.get("account_for_id"):
             data["account_for_id"] = data["account_id"]
 
-        return super().create(**data)
+        return data
+
+    #   Dimensions of the monthly rollup in TransactionAggregateModel
+    aggregate_keys = (
+        "period_id",
+        "account_id",
+        "account_for_id",
+        "category_id",
+        "subcategory_id",
+        "business_id",
+    )
+
+    def refresh_aggregates(self, period_ids: Iterable[int] | None = None) -> int:
+        """
+        Recompute the monthly rollup of the given periods or of all periods if none are given.
+        Return the number of rollup rows written
+        """
+        source = self.model.__table__
+        keys = [source.c[key] for key in self.aggregate_keys]
+        query = (
+            select(*keys, func.sum(source.c.amount), func.count())
+            .group_by(*keys)
+        )
+        remove = delete(TransactionAggregateModel)
+        if period_ids is not None:
+            period_ids = sorted(set(period_ids) - {None})
+            if not period_ids:
+                return 0
+            query = query.where(source.c.period_id.in_(period_ids))
+            remove = remove.where(TransactionAggregateModel.period_id.in_(period_ids))
+
+        add = insert(TransactionAggregateModel).from_select(
+            [*self.aggregate_keys, "amount", "count"],
+            query,
+        )
+        with self._bound() as manager:
+            manager.session.execute(remove.execution_options(synchronize_session=False))
+            result = manager.session.execute(add).rowcount
+
+        logger.info(f"Refreshed {result} aggregate rows")
+        return result
+
+    def _period_ids(self, *where: ColumnElement[bool]) -> set[int]:
+        """
+        Get the distinct periods of the transactions matching the conditions
+        """
+        query = select(self.model.period_id).distinct().where(*where)
+        with self._bound() as manager:
+            result = set(manager.session.scalars(query))
+        return result
+
+    def create(self, **data) -> BaseModel:
+        with self._bound() as manager:
+            result = super(TransactionManager, manager).create(**data)
+            manager.refresh_aggregates([result.period_id])
+        return result
+
+    def create_many(
+        self,
+        rows: Iterable[dict],
+        batch_size: int = 500,
+        on_conflict: str | None = None,
+    ) -> list[int]:
+        """
+        Refresh the rollup of the periods of the written rows. Updated rows may move from other
+        periods, so those are looked up by code first
+        """
+        with self._bound() as manager:
+            period_ids = set()
+            if on_conflict == "update":
+                rows = list(rows)
+                codes = [row["code"] for row in rows if row.get("code")]
+                for batch in batched(codes, batch_size):
+                    period_ids |= manager._period_ids(self.model.code.in_(batch))
+
+            result = super(TransactionManager, manager).create_many(rows, batch_size, on_conflict)
+            for batch in batched(result, batch_size):
+                period_ids |= manager._period_ids(self.model.id.in_(batch))
+            manager.refresh_aggregates(period_ids)
+        return result
+
+    def delete(self, id: int) -> BaseModel:
+        with self._bound() as manager:
+            result = super(TransactionManager, manager).delete(id)
+            manager.refresh_aggregates([result.period_id])
+        return result
 
     def update(self, id: int, **data) -> BaseModel:
         """
         Handle dates
         """
-        if "transaction_date" in data:
+        if isinstance(data.get("transaction_date"), str):
             data["transaction_date"] = dt.date.fromisoformat(data["transaction_date"])
 
-        return super().update(id, **data)
+        with self._bound() as manager:
+            period_id = manager.session.get(self.model, id).period_id
+            result = super(TransactionManager, manager).update(id, **data)
+            manager.refresh_aggregates([period_id, result.period_id])
+        return result
 
-    def from_qr_code(self, qrdata: QRData, **data):
-        business = BusinessManager(engine=self.engine).query(code=qrdata.business_code)
-        business = business[0] if business else business
-        if not business:
-            raise ValueError(f"Business with code: {qrdata.business_code} not found")
+    def update_many(self, filters: dict, values: dict) -> int:
+        with self._bound() as manager:
+            period_ids = manager._period_ids(*manager._where(filters))
+            result = super(TransactionManager, manager).update_many(filters, values)
+            if result:
+                if values.get("period_id"):
+                    period_ids.add(manager._coerce("period_id", values["period_id"]))
+                manager.refresh_aggregates(period_ids)
+        return result
 
-        period_manager = PeriodManager(engine=self.engine)
-        period_start = dt.date(qrdata.date.year, qrdata.date.month, 1)
-        period = period_manager.query(period_start=period_start)
-        if not period:
-            period = period_manager.create(period_start=period_start)
-        else:
-            period = period[0]
+    def delete_many(self, filters: dict) -> int:
+        with self._bound() as manager:
+            period_ids = manager._period_ids(*manager._where(filters))
+            result = super(TransactionManager, manager).delete_many(filters)
+            if result:
+                manager.refresh_aggregates(period_ids)
+        return result
 
-        #   Data given last so that it can override QR Code values
-        data = {
-            "amount": qrdata.amount,
-            "code": f"{qrdata.business_code}-{qrdata.transaction_code}",
-            "transaction_date": qrdata.date,
-            "business_id": business.id,
-            "period_id": period.id,
-            "category_id": business.default_category_id,
-            "subcategory_id": business.default_subcategory_id,
-            **data,
-        }
-        return self.create(**data)
+    def from_qr_code(self, qrdata: QRData, on_conflict: str | None = None, **data):
+        """
+        Create a transaction from receipt QR code data. With `on_conflict`, scanning a receipt
+        again updates the transaction or leaves it as is instead of failing
+        """
+        with self._bound() as manager:
+            business = manager._manager(BusinessManager).lookup(code=qrdata.business_code)
+            if not business:
+                raise ValueError(f"Business with code: {qrdata.business_code} not found")
+
+            period_manager = manager._manager(PeriodManager)
+            period_id = period_manager.get_period_id(period_manager.month_start(qrdata.date))
+
+            #   Data given last so that it can override QR Code values
+            data = {
+                "amount": qrdata.amount,
+                "code": f"{qrdata.business_code}-{qrdata.transaction_code}",
+                "transaction_date": qrdata.date,
+                "business_id": business.id,
+                "period_id": period_id,
+                "category_id": business.default_category_id,
+                "subcategory_id": business.default_subcategory_id,
+                **data,
+            }
+            if on_conflict:
+                return manager.upsert(on_conflict, **data)
+            return manager.create(**data)
@@ -3,12 +3,19 @@ Database models
 """
 
 import datetime as dt
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+import sys
+from typing import TextIO
 from uuid import uuid4
 
 import colorama
 from sqlalchemy import (
     ForeignKey,
+    Index,
+    Integer,
+    TypeDecorator,
+    event,
     func,
 )
 from sqlalchemy.orm import (
@@ -20,8 +27,60 @@ from sqlalchemy.orm import (
 
 colorama.just_fix_windows_console()
 
+#   Version of the database schema kept in PRAGMA user_version. Older databases are migrated by
+#   DBHandler.upgrade_schema
+SCHEMA_VERSION = 2
+
+
+@lru_cache(maxsize=8)
+def is_color(stream: TextIO) -> bool:
+    """
+    Whether to color output to a stream - only for terminals. Cached since it is checked for
+    every printed object
+    """
+    isatty = getattr(stream, "isatty", None)
+    return bool(isatty and isatty())
+
+
+def to_decimal(value: Decimal | float | int | str) -> Decimal:
+    """
+    Convert a number to Decimal exactly as written - floats through their shortest representation
+    """
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+class Money(TypeDecorator):
+    """
+    Decimal amount stored as an integer number of minor units (cents) so that the database sums
+    integers. Values are only converted to and from Decimal at the edges
+    """
+    impl = Integer
+    cache_ok = True
+    scale = 2
+
+    @property
+    def python_type(self) -> type:
+        return Decimal
+
+    def process_bind_param(self, value, dialect) -> int | None:
+        if value is None:
+            return None
+        return int(to_decimal(value).scaleb(self.scale).to_integral_value(ROUND_HALF_UP))
+
+    def process_literal_param(self, value, dialect) -> str:
+        return str(self.process_bind_param(value, dialect))
+
+    def process_result_value(self, value, dialect) -> Decimal | None:
+        if value is None:
+            return None
+        #   Averages are not whole numbers of cents
+        return to_decimal(value).scaleb(-self.scale)
+
 
 class BaseModel(DeclarativeBase):
+    #   Fetch server-generated timestamps with RETURNING instead of a separate select
+    __mapper_args__ = {"eager_defaults": True}
+
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     created_time: Mapped[dt.datetime] = mapped_column(
         server_default=func.now(),
@@ -31,26 +90,59 @@ class BaseModel(DeclarativeBase):
         onupdate=func.now(),
     )
 
-    def __repr__(self):
+    #   Per-class repr formats, see __declare_last__. Not annotated so they are not mapped
+    _repr_names = ()
+    _repr_formats = {}
+    _repr_relationships = ()
+
+    @classmethod
+    def __declare_last__(cls):
+        """
+        Precompute the column order and the plain and colored repr formats once the mappers are
+        configured instead of for every printed object
+        """
         sort_key = {"id": 0, "name": 1}
         ignore_cols = ("created_time", "updated_time")
-        name = self.__class__.__name__
-        fields = [
-            #   No coloring
-            f"{item.name}='{self.__dict__[item.name]}'"
-            if item.name not in ("id", "name")
-
-            #   Color for id and name
-            else (
-                f"{item.name}="
-                f"'{colorama.Style.BRIGHT}{self.__dict__[item.name]}{colorama.Style.RESET_ALL}'"
-            )
+        names = [
+            item.name
             for item
-            in sorted(self.__table__.c, key=lambda x: sort_key.get(x.name, 9999))
+            in sorted(cls.__table__.c, key=lambda x: sort_key.get(x.name, 9999))
             if item.name not in ignore_cols
         ]
-        result = f"{name}({', '.join(fields)})"
-        return result
+        bright, reset = colorama.Style.BRIGHT, colorama.Style.RESET_ALL
+        cls._repr_names = tuple(names)
+        cls._repr_formats = {
+            is_color: ", ".join(
+                #   Color for id and name
+                f"{name}='{bright}{{}}{reset}'"
+                if is_color and name in ("id", "name")
+                else f"{name}='{{}}'"
+                for name in names
+            )
+            for is_color in (False, True)
+        }
+        cls._repr_relationships = tuple(item.key for item in cls.__mapper__.relationships)
+
+    @staticmethod
+    def _display_name(item: "BaseModel | None") -> str | None:
+        if item is None:
+            return None
+        return getattr(item, "name", None) or getattr(item, "code", None) or item.id
+
+    def __repr__(self):
+        state = self.__dict__
+        fields = self._repr_formats[is_color(sys.stdout)].format(*(
+            state[name] if name in state else getattr(self, name, None)
+            for name in self._repr_names
+        ))
+
+        #   Show loaded relationships by name without triggering loads
+        related = "".join(
+            f", {key}='{self._display_name(state[key])}'"
+            for key in self._repr_relationships
+            if key in state
+        )
+        return f"{self.__class__.__name__}({fields}{related})"
 
 
 class CategoryModel(BaseModel):
@@ -83,15 +175,15 @@ class BusinessModel(BaseModel):
 class PeriodModel(BaseModel):
     __tablename__ = "period"
     code: Mapped[str] = mapped_column(unique=True)
-    period_start: Mapped[dt.date]
+    period_start: Mapped[dt.date] = mapped_column(index=True)
     period_end: Mapped[dt.date]
 
 
 class TransactionModel(BaseModel):
     __tablename__ = "transaction"
     code: Mapped[str] = mapped_column(unique=True, insert_default=lambda x: str(uuid4()))
-    amount: Mapped[Decimal]
-    transaction_date: Mapped[dt.date | None]
+    amount: Mapped[Decimal] = mapped_column(Money)
+    transaction_date: Mapped[dt.date | None] = mapped_column(index=True)
     account_id: Mapped[int] = mapped_column(ForeignKey("account.id"))
     account: Mapped["AccountModel"] = relationship(foreign_keys=[account_id])
     account_for_id: Mapped[int] = mapped_column(ForeignKey("account.id"))
@@ -102,5 +194,40 @@ class TransactionModel(BaseModel):
     subcategory: Mapped["SubcategoryModel"] = relationship()
     business_id: Mapped[int | None] = mapped_column(ForeignKey("business.id"))
     business: Mapped["BusinessModel"] = relationship()
-    period_id: Mapped[int] = mapped_column(ForeignKey("period.id"))
+    #   The rollup of a period is recomputed from its transactions
+    period_id: Mapped[int] = mapped_column(ForeignKey("period.id"), index=True)
     period: Mapped["PeriodModel"] = relationship()
+
+
+class TransactionAggregateModel(BaseModel):
+    """
+    Monthly rollup of transactions for the reports. Maintained by TransactionManager for every
+    period whose transactions are written. Rows are derived from the transactions, so they have no
+    foreign keys of their own - older databases may hold transactions of deleted rows
+    """
+    __tablename__ = "transaction_aggregate"
+    __table_args__ = (
+        Index(
+            "ix_transaction_aggregate_key",
+            "period_id", "account_id", "account_for_id", "category_id", "subcategory_id",
+            "business_id",
+            unique=True,
+        ),
+    )
+    period_id: Mapped[int]
+    account_id: Mapped[int]
+    account_for_id: Mapped[int]
+    category_id: Mapped[int]
+    subcategory_id: Mapped[int]
+    business_id: Mapped[int | None]
+    amount: Mapped[Decimal] = mapped_column(Money)
+    count: Mapped[int]
+
+
+@event.listens_for(BaseModel.metadata, "after_create")
+def set_schema_version(target, connection, tables=(), **kwargs):
+    """
+    Mark newly created databases with the current schema version so they are not migrated
+    """
+    if TransactionModel.__table__ in tables:
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
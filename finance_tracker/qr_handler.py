@@ -7,6 +7,7 @@ Format:
 
 from dataclasses import dataclass
 import datetime as dt
+from decimal import Decimal
 import logging
 from typing import Self
 import sys
@@ -72,7 +73,7 @@ class QRData:
     transaction_code: str
     date: dt.date
     time: dt.time
-    amount: float
+    amount: Decimal
     datetime: dt.datetime | None = None
 
     def __post_init__(self):
@@ -101,5 +102,5 @@ class QRData:
         }
         items["date"] = dt.date.fromisoformat(items["date"])
         items["time"] = dt.time.fromisoformat(items["time"])
-        items["amount"] = float(items["amount"])
+        items["amount"] = Decimal(items["amount"])
         return cls(**items)
@@ -1,129 +1,316 @@
 """
 Reporting front-end
+
+The application is created with `create_app`. Engines and render pools are created per process on
+first use, so that every worker process of the server gets its own connection pool
 """
 
+import atexit
+import base64
+from collections.abc import Callable
+from concurrent.futures import Executor
+import datetime as dt
+from decimal import Decimal
+import logging
+import os
+from threading import Lock, Thread
+
 from flask import (
+    Blueprint,
     Flask,
+    Response,
+    abort,
+    current_app,
+    jsonify,
     render_template,
     request,
+    url_for,
 )
+from flask.json.provider import DefaultJSONProvider
 from sqlalchemy import select
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
+from werkzeug.datastructures import MultiDict
 
+from finance_tracker.cache import (
+    lookup,
+    lookups,
+)
 from finance_tracker.models import (
     AccountModel,
+    BaseModel,
     PeriodModel,
 )
-from finance_tracker.report.summary import (
-    SummaryMetrics,
-    SummaryPlot,
+from finance_tracker.report.service import (
+    QUERY_THREADS,
+    SummaryKey,
+    create_query_pool,
+    create_render_pool,
+    get_charts,
+    get_summary,
+    summary_cache,
+    summary_flights,
 )
 
 
-app = Flask(__name__)
+class ReportJSONProvider(DefaultJSONProvider):
+    """
+    Amounts as numbers and dates in ISO format for the charts
+    """
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        if isinstance(o, dt.date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
 
 
-def get_accounts(sess: Session) -> dict[int, str]:
-    query = (
-        select(AccountModel.id, AccountModel.name)
-        .order_by(AccountModel.id)
-    )
-    data = sess.execute(query).all()
-    result = {item.id: item.name for item in data}
-    return result
+logger = logging.getLogger(__name__)
+bp = Blueprint("report", __name__)
+_lock = Lock()
 
 
-def get_periods(sess: Session) -> dict[int, str]:
-    query = (
-        select(PeriodModel.id, PeriodModel.period_start)
-        .order_by(PeriodModel.period_start)
-    )
-    data = sess.execute(query).all()
-    result = {item.id: item.period_start.isoformat() for item in data}
-    return result
+def create_app(
+    engine_factory: Callable[[], Engine],
+    render_workers: int = 0,
+    query_threads: int = QUERY_THREADS,
+) -> Flask:
+    """
+    Create the report application
+
+    Args:
+        engine_factory: create an engine of the database. Called once in every server process
+        render_workers: render charts in a process pool of this size. 0 renders in the request
+            thread
+        query_threads: run the summary queries concurrently in a thread pool of this size shared
+            by the requests of a process. 0 runs them one after another in the request thread
+    """
+    app = Flask(__name__)
+    app.json = ReportJSONProvider(app)
+    app.config["ENGINE_FACTORY"] = engine_factory
+    app.config["RENDER_WORKERS"] = render_workers
+    app.config["QUERY_THREADS"] = query_threads
+    app.register_blueprint(bp)
+    return app
+
+
+def _process_resources() -> dict:
+    """
+    Resources of the application in the current process. They are dropped in processes forked
+    after their creation and released when the process exits
+    """
+    resources = current_app.extensions.setdefault("finance_tracker", {})
+    if resources.get("pid") != os.getpid():
+        resources.clear()
+        resources["pid"] = os.getpid()
+    return resources
+
+
+def get_engine() -> Engine:
+    with _lock:
+        resources = _process_resources()
+        if "engine" not in resources:
+            resources["engine"] = current_app.config["ENGINE_FACTORY"]()
+            atexit.register(resources["engine"].dispose)
+        return resources["engine"]
+
+
+def get_query_executor() -> Executor | None:
+    threads = current_app.config["QUERY_THREADS"]
+    if not threads:
+        return None
+
+    with _lock:
+        resources = _process_resources()
+        if "query_executor" not in resources:
+            resources["query_executor"] = create_query_pool(threads)
+            atexit.register(resources["query_executor"].shutdown, cancel_futures=True)
+        return resources["query_executor"]
+
+
+def get_render_executor() -> Executor | None:
+    workers = current_app.config["RENDER_WORKERS"]
+    if not workers:
+        return None
+
+    with _lock:
+        resources = _process_resources()
+        if "render_executor" not in resources:
+            resources["render_executor"] = create_render_pool(workers)
+            atexit.register(resources["render_executor"].shutdown, cancel_futures=True)
+        return resources["render_executor"]
+
+
+def _names(engine: Engine, model: type[BaseModel]) -> dict[int, str]:
+    with Session(engine) as sess:
+        data = sess.execute(select(model.id, model.name).order_by(model.id)).all()
+    return {item.id: item.name for item in data}
+
+
+def get_accounts(engine: Engine) -> dict[int, str]:
+    return lookup(engine, AccountModel.__tablename__, lambda: _names(engine, AccountModel))
+
+
+def get_periods(engine: Engine) -> dict[int, str]:
+    def load():
+        query = (
+            select(PeriodModel.id, PeriodModel.period_start)
+            .order_by(PeriodModel.period_start)
+        )
+        with Session(engine) as sess:
+            data = sess.execute(query).all()
+        return {item.id: item.period_start.isoformat() for item in data}
+
+    return lookup(engine, PeriodModel.__tablename__, load)
+
+
+def warm_up(app: Flask, periods: int = 3):
+    """
+    Precompute the default summary view - the latest period without account filters - and the
+    views of the previous periods, so that first requests are served from the cache. Charts are
+    rendered for the latest period only, which also loads matplotlib. Failing charts do not keep
+    the summaries from being warmed up
+    """
+    with app.app_context():
+        engine = get_engine()
+        period_ids = list(get_periods(engine))[-periods:][::-1]
 
+        for period_id in period_ids:
+            key = SummaryKey.current(engine, period_id=period_id)
+            get_summary(engine, key, get_query_executor())
+        logger.info(f"Warmed up summaries of {len(period_ids)} periods")
 
-@app.route("/")
+        if not period_ids:
+            return
+        try:
+            key = SummaryKey.current(engine, period_id=period_ids[0])
+            get_charts(engine, key, get_query_executor(), get_render_executor())
+        except Exception:
+            logger.exception("Warm-up of the charts failed")
+
+
+def start_warm_up(app: Flask, periods: int = 3) -> Thread:
+    """
+    Warm up in a background thread of the current process. Requests are served meanwhile
+    """
+    def run():
+        try:
+            warm_up(app, periods)
+        except Exception:
+            logger.exception("Warm-up failed")
+
+    thread = Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+@bp.route("/")
 def home():
     return render_template("home.html")
 
 
-@app.route("/summary/", methods=["GET", "POST"])
-def summary():
-    with Session(app.config.engine) as sess:
-        periods = get_periods(sess)
-        accounts = get_accounts(sess)
-        period_id = request.form.get("period", default=list(periods.keys())[-1], type=int)
-        account_ids = request.form.getlist("account", int)
-        account_for_ids = request.form.getlist("account_for", int)
-
-        metrics = SummaryMetrics(
-            sess,
-            period_id=period_id,
-            account_ids=account_ids,
-            account_for_ids=account_for_ids,
-        )
-        current_month_spend = metrics.current_month_total()
-        last_month_spend = metrics.previous_month_total()
-        previous_year_spend = metrics.previous_year_total()
-        top_businesses = metrics.top_businesses() or []
-        top_categories = metrics.top_categories() or []
-
-        account_for_data = metrics.get_account_for_total()
-        history_data = metrics.get_history()
-
-    #   Format items
-    top_businesses_header = [
-        item.replace("_", " ").title()
-        for item
-        in top_businesses[0]._fields
-    ] if top_businesses else []
-    top_categories_header = [
-        item.replace("_", " ").title()
-        for item
-        in top_categories[0]._fields
-    ] if top_categories else []
-
-    #   Images
-    plot = SummaryPlot()
-    account_for_graph = plot.make_barplot(
-        account_for_data,
-        category="account_for_name",
-        target="amount",
-        y_label="Amount",
-        x_label="Account For",
-    )
-    history_graph = plot.make_linechart(
-        history_data,
-        period="period_start",
-        target="amount",
-        y_label="Amount",
-        x_label="Period",
-        x_rotate=45,
+def get_summary_key(values: MultiDict, default_period_id: int | None = None) -> SummaryKey:
+    """
+    Summary key of the filters in form or query values
+    """
+    return SummaryKey.current(
+        get_engine(),
+        period_id=values.get("period", default=default_period_id, type=int),
+        account_ids=values.getlist("account", int),
+        account_for_ids=values.getlist("account_for", int),
     )
 
+
+def conditional(response: Response) -> Response:
+    """
+    Tag a response with a hash of its content and turn it into 304 Not Modified if the client
+    already has it. Tags do not depend on the serving process, so all workers agree on them.
+    Clients have to revalidate every time
+    """
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@bp.route("/summary/", methods=["GET", "POST"])
+def summary():
+    periods = get_periods(get_engine())
+    accounts = get_accounts(get_engine())
+
+    key = get_summary_key(request.form, default_period_id=list(periods.keys())[-1])
+    data = get_summary(get_engine(), key, get_query_executor())
+    filters = {
+        "period": key.period_id,
+        "account": list(key.account_ids),
+        "account_for": list(key.account_for_ids),
+    }
+
     return render_template(
         "summary.html",
         #   Filters
         period_values=periods,
-        period_selected=[period_id],
+        period_selected=[key.period_id],
         account_values=accounts,
-        account_selected=account_ids,
+        account_selected=key.account_ids,
         account_for_values=accounts,
-        account_for_selected=account_for_ids,
-
-        #   Metrics
-        current_month_spend=current_month_spend,
-        last_month_spend=last_month_spend,
-        previous_year_spend=previous_year_spend,
-
-        #   Tables
-        top_businesses_headers=top_businesses_header,
-        top_businesses_data=top_businesses,
-        top_categories_headers=top_categories_header,
-        top_categories_data=top_categories,
-
-        #   Images
-        account_for_graph=account_for_graph,
-        history_graph=history_graph,
+        account_for_selected=key.account_for_ids,
+
+        #   Metrics and tables
+        totals=data["totals"],
+        top_businesses=data["top_businesses"],
+        top_categories=data["top_categories"],
+
+        #   Charts are drawn from the data API, images are a fallback without JavaScript
+        api_url=url_for(".summary_api", **filters),
+        account_for_image_url=url_for(".summary_chart", name="account_for", **filters),
+        history_image_url=url_for(".summary_chart", name="history", **filters),
+    )
+
+
+@bp.route("/api/summary/")
+def summary_api():
+    """
+    Summary report data as JSON
+    """
+    key = get_summary_key(request.args)
+    return conditional(jsonify(get_summary(get_engine(), key, get_query_executor())))
+
+
+@bp.route("/summary/charts/<name>.png")
+def summary_chart(name: str):
+    """
+    Server-rendered chart image
+    """
+    if name not in ("account_for", "history"):
+        abort(404)
+
+    charts = get_charts(
+        get_engine(),
+        get_summary_key(request.args),
+        query_executor=get_query_executor(),
+        render_executor=get_render_executor(),
     )
+    return conditional(
+        current_app.response_class(base64.b64decode(charts[name]), mimetype="image/png"),
+    )
+
+
+@bp.route("/api/stats/")
+def stats():
+    """
+    Cache, lookup and request coalescing counters of the serving process
+    """
+    cache = summary_cache(get_engine())
+    flights = summary_flights(get_engine())
+    reference = lookups(get_engine())
+    return jsonify({
+        "pid": os.getpid(),
+        "summary_cache": {"size": len(cache), "hits": cache.hits, "misses": cache.misses},
+        "lookups": {"size": len(reference), "hits": reference.hits, "misses": reference.misses},
+        "summary_flights": {
+            "in_flight": len(flights),
+            "calls": flights.calls,
+            "coalesced": flights.coalesced,
+        },
+    })
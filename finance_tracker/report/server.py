@@ -0,0 +1,79 @@
+"""
+Production server of the report application
+
+Gunicorn runs several worker processes with threads each and restarts workers that die. On
+SIGTERM or SIGINT workers finish their current requests before exiting. Where gunicorn is not
+available, e.g. on Windows, waitress serves with threads in a single process
+"""
+
+from collections.abc import Callable
+import logging
+
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+#   Seconds for workers to finish their requests on shutdown
+GRACEFUL_TIMEOUT = 30
+
+
+def split_bind(bind: str) -> tuple[str, int]:
+    """
+    Split a HOST:PORT address. The host defaults to localhost
+    """
+    host, _, port = bind.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError as ex:
+        raise ValueError(f"Invalid address, expected HOST:PORT: {bind}") from ex
+
+
+def serve(
+    app: Flask,
+    bind: str = "127.0.0.1:5000",
+    workers: int = 1,
+    threads: int = 4,
+    on_start: Callable[[], None] | None = None,
+):
+    """
+    Serve the application with gunicorn or waitress until stopped. `on_start` is called in every
+    serving process before it accepts requests
+    """
+    if workers < 1 or threads < 1:
+        raise ValueError(f"Workers and threads must be positive: {workers}, {threads}")
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is None:
+        try:
+            import waitress
+        except ImportError as ex:
+            raise RuntimeError(
+                "A production server is needed: pip install finance_tracker[server]"
+            ) from ex
+
+        if workers > 1:
+            logger.warning("Waitress serves in a single process, using threads only")
+        host, port = split_bind(bind)
+        if on_start:
+            on_start()
+        waitress.serve(app, host=host, port=port, threads=threads)
+        return
+
+    class ReportApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [bind])
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT)
+            if on_start:
+                self.cfg.set("post_worker_init", lambda worker: on_start())
+
+        def load(self):
+            return app
+
+    ReportApplication().run()
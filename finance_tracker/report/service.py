@@ -0,0 +1,250 @@
+"""
+Summary report data for the report server
+
+Summaries are cached by filters and data version, so repeated views of the dashboard are served
+from memory until the next write to the database
+"""
+
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import multiprocessing
+from typing import Any, Self
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from finance_tracker.cache import (
+    LRUCache,
+    data_version,
+    get_cache,
+)
+from finance_tracker.report.singleflight import SingleFlight
+from finance_tracker.report.summary import (
+    SummaryMetrics,
+    SummaryPlot,
+)
+
+CACHE_SIZE = 64
+#   Render workers are replaced after this many charts to bound their memory
+RENDER_TASKS_PER_CHILD = 500
+#   Summary queries running at the same time in a process
+QUERY_THREADS = 4
+
+
+@dataclass(frozen=True)
+class SummaryKey:
+    """
+    Filters of a summary report together with the data version they were requested at
+    """
+    period_id: int | None
+    account_ids: tuple[int, ...]
+    account_for_ids: tuple[int, ...]
+    version: tuple
+
+    @classmethod
+    def current(
+        cls,
+        engine: Engine,
+        period_id: int | None = None,
+        account_ids: Iterable[int] = (),
+        account_for_ids: Iterable[int] = (),
+    ) -> Self:
+        """
+        Key of the filters at the current data version. Read the version before the data so that a
+        concurrent write leads to a recomputation
+        """
+        return cls(
+            period_id=period_id,
+            account_ids=tuple(sorted(set(account_ids))),
+            account_for_ids=tuple(sorted(set(account_for_ids))),
+            version=data_version(engine),
+        )
+
+
+def summary_cache(engine: Engine) -> LRUCache:
+    return get_cache(engine, "summary", lambda: LRUCache(maxsize=CACHE_SIZE))
+
+
+def summary_flights(engine: Engine) -> SingleFlight:
+    return get_cache(engine, "summary_flights", SingleFlight)
+
+
+def _cached(engine: Engine, key: tuple, compute: Callable[[], Any]) -> Any:
+    """
+    Get a value from the summary cache or compute and store it. Concurrent requests of a missing
+    value share one computation. Entries of older data versions are never hit again and age out of
+    the cache
+    """
+    cache = summary_cache(engine)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    def compute_once():
+        #   The previous flight may have finished since the lookup
+        if key in cache:
+            return cache.get(key)
+
+        value = compute()
+        cache.set(key, value)
+        return value
+
+    return summary_flights(engine).do(key, compute_once)
+
+
+def create_query_pool(threads: int = QUERY_THREADS) -> ThreadPoolExecutor:
+    """
+    Create a bounded thread pool for the summary queries
+    """
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix="summary-query")
+
+
+def create_render_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Create a process pool for chart rendering. Workers are spawned rather than forked from the
+    threaded server
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        max_tasks_per_child=RENDER_TASKS_PER_CHILD,
+    )
+
+
+def _done(value: Any) -> Future:
+    result = Future()
+    result.set_result(value)
+    return result
+
+
+def _submit(executor: Executor | None, function: Callable, *args, **kwargs) -> Future:
+    """
+    Submit a call to the executor or make it in this thread if there is none
+    """
+    if executor is not None:
+        return executor.submit(function, *args, **kwargs)
+
+    result = Future()
+    try:
+        result.set_result(function(*args, **kwargs))
+    except Exception as ex:
+        result.set_exception(ex)
+    return result
+
+
+def render_charts(data: dict[str, Future], executor: Executor | None = None) -> dict[str, str]:
+    """
+    Render the account for and history charts from futures of their data. Each chart is rendered
+    as soon as its data is ready, in parallel on the executor if one is given
+    """
+    plot = SummaryPlot()
+    jobs = {
+        "account_for": (
+            plot.make_barplot,
+            {
+                "category": "account_for_name",
+                "target": "amount",
+                "y_label": "Amount",
+                "x_label": "Account For",
+            },
+        ),
+        "history": (
+            plot.make_linechart,
+            {
+                "period": "period_start",
+                "target": "amount",
+                "y_label": "Amount",
+                "x_label": "Period",
+                "x_rotate": 45,
+            },
+        ),
+    }
+    futures = {
+        name: _submit(executor, function, data[name].result(), **kwargs)
+        for name, (function, kwargs) in jobs.items()
+    }
+    return {name: item.result() for name, item in futures.items()}
+
+
+#   Independent queries of the summary report by result name. Chart data first so that charts can
+#   be rendered while the other queries run
+SUMMARY_QUERIES = {
+    "account_for": lambda metrics: [dict(row) for row in metrics.get_account_for_total()],
+    "history": lambda metrics: [dict(row) for row in metrics.get_history()],
+    "totals": SummaryMetrics.totals,
+    "top_businesses": lambda metrics: [dict(row._mapping) for row in metrics.top_businesses()],
+    "top_categories": lambda metrics: [dict(row._mapping) for row in metrics.top_categories()],
+}
+
+
+def submit_summary(engine: Engine, key: SummaryKey, executor: Executor | None = None) -> dict:
+    """
+    Start the queries of the summary report and return futures of their results. With an executor
+    every query runs in its own session on a separate pooled connection - concurrent readers of a
+    database in WAL mode. This needs a file database since each thread gets its own in-memory one
+    """
+    with Session(engine) as sess:
+        metrics = SummaryMetrics(
+            sess,
+            period_id=key.period_id,
+            account_ids=list(key.account_ids),
+            account_for_ids=list(key.account_for_ids),
+        )
+
+    def run(query: Callable[[SummaryMetrics], Any]) -> Any:
+        with Session(engine) as sess:
+            return query(SummaryMetrics(
+                sess,
+                period_id=metrics.period_id,
+                period=metrics.period,
+                account_ids=metrics.account_ids,
+                account_for_ids=metrics.account_for_ids,
+            ))
+
+    return {
+        "period_id": _done(metrics.period_id),
+        "period": _done(metrics.period),
+        **{name: _submit(executor, run, query) for name, query in SUMMARY_QUERIES.items()},
+    }
+
+
+def compute_summary(engine: Engine, key: SummaryKey, executor: Executor | None = None) -> dict:
+    """
+    Compute the metrics and tables of the summary report as plain values
+    """
+    futures = submit_summary(engine, key, executor)
+    return {name: item.result() for name, item in futures.items()}
+
+
+def get_summary(engine: Engine, key: SummaryKey, executor: Executor | None = None) -> dict:
+    """
+    Get the metrics and tables of the summary report. Queries run concurrently on the executor if
+    one is given
+    """
+    return _cached(engine, ("summary", key), lambda: compute_summary(engine, key, executor))
+
+
+def get_charts(
+    engine: Engine,
+    key: SummaryKey,
+    query_executor: Executor | None = None,
+    render_executor: Executor | None = None,
+) -> dict[str, str]:
+    """
+    Get the base64-encoded chart images of the summary report by chart name. Without cached data,
+    charts are rendered while the remaining queries run
+    """
+    def compute():
+        cache = summary_cache(engine)
+        data = cache.get(("summary", key))
+        if data is not None:
+            futures = {name: _done(value) for name, value in data.items()}
+            return render_charts(futures, render_executor)
+
+        futures = submit_summary(engine, key, query_executor)
+        result = render_charts(futures, render_executor)
+        cache.set(("summary", key), {name: item.result() for name, item in futures.items()})
+        return result
+
+    return _cached(engine, ("charts", key), compute)
@@ -0,0 +1,63 @@
+"""
+Request coalescing for the report server
+
+Concurrent requests for the same report share one computation instead of repeating the same
+queries and chart rendering once per request
+"""
+
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time. Callers arriving while a call with their key is in
+    flight wait for it and get its result or exception. Calls are counted as executed and coalesced
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict[Hashable, Future] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(in_flight={len(self)}, calls={self.calls}, "
+            f"coalesced={self.coalesced})"
+        )
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Future()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = function()
+        except BaseException as ex:
+            flight.set_exception(ex)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def clear(self):
+        """
+        Nothing to drop - calls are only kept while in flight
+        """
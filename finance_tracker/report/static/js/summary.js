@@ -0,0 +1,106 @@
+/*	Charts of the summary report drawn from the data API	*/
+(function () {
+	"use strict";
+
+	const script = document.currentScript;
+	const svgNamespace = "http://www.w3.org/2000/svg";
+	const size = {width: 640, height: 320, top: 20, right: 20, bottom: 70, left: 60};
+
+	function element(name, attributes, parent, text) {
+		const result = document.createElementNS(svgNamespace, name);
+		for (const [key, value] of Object.entries(attributes)) {
+			result.setAttribute(key, value);
+		}
+		if (text !== undefined) {
+			result.textContent = text;
+		}
+		parent.appendChild(result);
+		return result;
+	}
+
+	function formatAmount(value) {
+		return value.toLocaleString(undefined, {maximumFractionDigits: 2});
+	}
+
+	/*	Bar or line chart of values by label with a y axis starting at zero	*/
+	function drawChart(container, labels, values, kind, xRotate) {
+		const width = size.width - size.left - size.right;
+		const height = size.height - size.top - size.bottom;
+		const yMax = (Math.max(0, ...values) || 1) * 1.1;
+		const step = width / Math.max(labels.length, 1);
+		const x = (index) => size.left + step * (index + 0.5);
+		const y = (value) => size.top + height * (1 - value / yMax);
+
+		container.replaceChildren();
+		const svg = element("svg", {
+			viewBox: `0 0 ${size.width} ${size.height}`,
+			width: "100%",
+			role: "img",
+		}, container);
+
+		//	Grid and y axis labels
+		for (let tick = 0; tick <= 4; tick++) {
+			const value = yMax * tick / 4;
+			element("line", {
+				x1: size.left, x2: size.left + width, y1: y(value), y2: y(value),
+				stroke: "#ddd",
+			}, svg);
+			element("text", {
+				x: size.left - 6, y: y(value) + 4, "text-anchor": "end", "font-size": 11,
+			}, svg, formatAmount(value));
+		}
+
+		//	X axis labels
+		labels.forEach((label, index) => {
+			const top = size.top + height + 14;
+			element("text", {
+				x: x(index),
+				y: top,
+				"text-anchor": xRotate ? "end" : "middle",
+				"font-size": 11,
+				transform: xRotate ? `rotate(-${xRotate} ${x(index)} ${top})` : "",
+			}, svg, label);
+		});
+
+		if (kind === "bar") {
+			values.forEach((value, index) => {
+				element("rect", {
+					x: x(index) - step * 0.4,
+					y: y(value),
+					width: step * 0.8,
+					height: size.top + height - y(value),
+					fill: "#1f77b4",
+				}, svg);
+				element("text", {
+					x: x(index), y: y(value) - 4, "text-anchor": "middle", "font-size": 11,
+				}, svg, formatAmount(value));
+			});
+		} else {
+			element("polyline", {
+				points: values.map((value, index) => `${x(index)},${y(value)}`).join(" "),
+				fill: "none",
+				stroke: "#1f77b4",
+				"stroke-width": 2,
+			}, svg);
+		}
+	}
+
+	//	The browser revalidates with the ETag of the previous response and reuses it on 304
+	fetch(script.dataset.url, {headers: {Accept: "application/json"}})
+		.then((response) => response.json())
+		.then((data) => {
+			drawChart(
+				document.getElementById("account-for-chart"),
+				data.account_for.map((row) => row.account_for_name),
+				data.account_for.map((row) => row.amount || 0),
+				"bar",
+			);
+			drawChart(
+				document.getElementById("history-chart"),
+				data.history.map((row) => row.period_start),
+				data.history.map((row) => row.amount || 0),
+				"line",
+				45,
+			);
+		});
+})();
@@ -11,16 +11,19 @@ What do we want in terms of data?
 - graph: Totals of last 12 months - absolute values
 - filter: account_id + name
 - (future): multi-select - add child accounts
+
+The queries read the monthly rollup in TransactionAggregateModel rather than the transactions, so
+their cost depends on the number of months and dimensions only
 """
 
 import base64
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 import datetime as dt
+from decimal import Decimal
 import io
 
-import matplotlib
-import matplotlib.pyplot as plt
-from sqlalchemy import select, func, column, Select, and_
+from matplotlib.figure import Figure
+from sqlalchemy import select, func, case, column, Select, and_
 from sqlalchemy.orm import Session
 
 from finance_tracker.models import (
@@ -28,13 +31,10 @@ from finance_tracker.models import (
     BusinessModel,
     CategoryModel,
     PeriodModel,
-    TransactionModel,
+    TransactionAggregateModel,
 )
 
 
-matplotlib.use("svg")
-
-
 @dataclass
 class SummaryMetrics:
     sess: Session
@@ -42,10 +42,13 @@ class SummaryMetrics:
     account_ids: list[int] | None = None
     account_for_ids: list[int] | None = None
     top_n: int = 10
-
-    period: dt.date = field(init=False)
+    #   Start of the period if already known, e.g. from another instance
+    period: dt.date | None = None
 
     def __post_init__(self):
+        if self.period_id is not None and self.period is not None:
+            return
+
         if self.period_id:
             period = self.sess.scalars(
                 select(PeriodModel)
@@ -57,7 +60,7 @@ class SummaryMetrics:
                 select(PeriodModel)
                 .where(
                     PeriodModel.id.in_(
-                        select(TransactionModel.period_id)
+                        select(TransactionAggregateModel.period_id)
                         .distinct()
                         .scalar_subquery()
                     )
@@ -67,11 +70,11 @@ class SummaryMetrics:
             self.period_id = period.id
             self.period = period.period_start
 
-    def _get_total_query(self, period: dt.date) -> float:
+    def _get_total_query(self, period: dt.date) -> Select:
         query = (
-            select(func.sum(TransactionModel.amount).label("amount"))
+            select(func.sum(TransactionAggregateModel.amount).label("amount"))
             .where(
-                TransactionModel.period_id == (
+                TransactionAggregateModel.period_id == (
                     select(PeriodModel.id)
                     .where(
                         PeriodModel.period_start == period,
@@ -80,12 +83,12 @@ class SummaryMetrics:
                     .scalar_subquery()
                 )
             )
-            .group_by(TransactionModel.period_id)
+            .group_by(TransactionAggregateModel.period_id)
         )
         return query
 
     def _filter_accounts(self, query: Select | None = None) -> Select:
-        query = query if query is not None else TransactionModel.__table__
+        query = query if query is not None else TransactionAggregateModel.__table__
         result = and_(
             (query.c.account_id.in_(self.account_ids) if self.account_ids else True),
             (
@@ -96,99 +99,194 @@ class SummaryMetrics:
         )
         return result
 
-    def current_month_total(self) -> float:
+    def _comparison_periods(self) -> tuple[dt.date, dt.date, dt.date]:
+        """
+        Start of the current period, the previous month and the same month of the previous year
+        """
+        previous_month = dt.date(self.period.year, self.period.month, 1) - dt.timedelta(days=1)
+        previous_month = dt.date(previous_month.year, previous_month.month, 1)
+        previous_year = dt.date(self.period.year - 1, self.period.month, self.period.day)
+        return self.period, previous_month, previous_year
+
+    def current_month_total(self) -> Decimal:
         query = self._get_total_query(self.period)
-        return self.sess.scalar(query) or 0.0
+        return self.sess.scalar(query) or Decimal(0)
 
-    def previous_month_total(self) -> float:
-        period = dt.date(self.period.year, self.period.month, 1) - dt.timedelta(days=1)
-        period = dt.date(period.year, period.month, 1)
+    def previous_month_total(self) -> Decimal:
+        _, period, _ = self._comparison_periods()
         query = self._get_total_query(period)
-        return self.sess.scalar(query) or 0.0
+        return self.sess.scalar(query) or Decimal(0)
 
-    def previous_year_total(self) -> float:
-        period = dt.date(self.period.year - 1, self.period.month, self.period.day)
+    def previous_year_total(self) -> Decimal:
+        _, _, period = self._comparison_periods()
         query = self._get_total_query(period)
-        return self.sess.scalar(query) or 0.0
+        return self.sess.scalar(query) or Decimal(0)
 
-    def top_businesses(self) -> list[dict]:
+    def _totals_query(self) -> Select:
+        periods = dict(zip(
+            ("current", "previous_month", "previous_year"),
+            self._comparison_periods(),
+        ))
+        query = (
+            select(*(
+                func.coalesce(
+                    func.sum(case(
+                        (PeriodModel.period_start == period, TransactionAggregateModel.amount),
+                    )),
+                    0,
+                ).label(name)
+                for name, period in periods.items()
+            ))
+            .join_from(
+                TransactionAggregateModel,
+                PeriodModel,
+                onclause=TransactionAggregateModel.period_id == PeriodModel.id,
+            )
+            .where(
+                PeriodModel.period_start.in_(list(periods.values())),
+                self._filter_accounts(),
+            )
+        )
+        return query
+
+    @staticmethod
+    def _change(current: Decimal, previous: Decimal) -> tuple[Decimal, Decimal | None]:
+        """
+        Absolute and percent change from a previous total. No percent change from zero
+        """
+        change = current - previous
+        percent = round(change / previous * 100, 2) if previous else None
+        return change, percent
+
+    def totals(self) -> dict[str, Decimal | None]:
+        """
+        Current, previous month and previous year totals with the month over month and year over
+        year changes. The totals are summed in one query with one conditional sum per period
+        """
+        result = dict(self.sess.execute(self._totals_query()).mappings().one())
+        result["month_over_month"], result["month_over_month_pct"] = self._change(
+            result["current"], result["previous_month"],
+        )
+        result["year_over_year"], result["year_over_year_pct"] = self._change(
+            result["current"], result["previous_year"],
+        )
+        return result
+
+    def explain(self) -> dict[str, list[str]]:
+        """
+        Get the SQLite query plan of each summary query to check which indexes are used
+        """
+        queries = {
+            "totals": self._totals_query(),
+            "top_businesses": self._top_businesses_query(),
+            "top_categories": self._top_categories_query(),
+            "account_for_total": self._account_for_total_query(),
+            "history": self._history_query(),
+        }
+        result = {}
+        for name, query in queries.items():
+            compiled = query.compile(
+                dialect=self.sess.get_bind().dialect,
+                compile_kwargs={"literal_binds": True},
+            )
+            plan = self.sess.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+            depths = {0: -1}
+            result[name] = []
+            for id, parent, _, detail in plan:
+                depths[id] = depths.get(parent, -1) + 1
+                result[name].append(f"{'  ' * depths[id]}{detail}")
+        return result
+
+    def _top_businesses_query(self) -> Select:
         query = (
             select(
-                TransactionModel.business_id,
+                TransactionAggregateModel.business_id,
                 BusinessModel.name,
-                func.count(TransactionModel.id).label("count"),
-                func.sum(TransactionModel.amount).label("amount"),
+                func.sum(TransactionAggregateModel.count).label("count"),
+                func.sum(TransactionAggregateModel.amount).label("amount"),
             )
             .join_from(
-                TransactionModel,
+                TransactionAggregateModel,
                 BusinessModel,
-                onclause=TransactionModel.business_id == BusinessModel.id,
+                onclause=TransactionAggregateModel.business_id == BusinessModel.id,
                 isouter=True,
             )
             .where(
-                TransactionModel.period_id == self.period_id,
+                TransactionAggregateModel.period_id == self.period_id,
                 self._filter_accounts(),
             )
-            .group_by(TransactionModel.business_id)
+            .group_by(TransactionAggregateModel.business_id)
             .order_by(column("amount").desc())
             .limit(self.top_n)
         )
-        return self.sess.execute(query).all()
+        return query
 
-    def top_categories(self) -> list[dict]:
+    def top_businesses(self) -> list[dict]:
+        return self.sess.execute(self._top_businesses_query()).all()
+
+    def _top_categories_query(self) -> Select:
         query = (
             select(
-                TransactionModel.category_id,
+                TransactionAggregateModel.category_id,
                 CategoryModel.name,
-                func.count(TransactionModel.id).label("count"),
-                func.sum(TransactionModel.amount).label("amount"),
+                func.sum(TransactionAggregateModel.count).label("count"),
+                func.sum(TransactionAggregateModel.amount).label("amount"),
             )
             .join_from(
-                TransactionModel,
+                TransactionAggregateModel,
                 CategoryModel,
-                onclause=TransactionModel.category_id == CategoryModel.id,
+                onclause=TransactionAggregateModel.category_id == CategoryModel.id,
                 isouter=True,
             )
             .where(
-                TransactionModel.period_id == self.period_id,
+                TransactionAggregateModel.period_id == self.period_id,
                 self._filter_accounts(),
             )
-            .group_by(TransactionModel.category_id)
+            .group_by(TransactionAggregateModel.category_id)
             .order_by(column("amount").desc())
             .limit(self.top_n)
         )
-        return self.sess.execute(query).all()
+        return query
 
-    def get_account_for_total(self) -> list[dict]:
+    def top_categories(self) -> list[dict]:
+        return self.sess.execute(self._top_categories_query()).all()
+
+    def _account_for_total_query(self) -> Select:
         query = (
             select(
-                TransactionModel.account_for_id,
+                TransactionAggregateModel.account_for_id,
                 func.max(AccountModel.name).label("account_for_name"),
-                func.sum(TransactionModel.amount).label("amount"),
+                func.sum(TransactionAggregateModel.amount).label("amount"),
             )
             .outerjoin(
                 AccountModel,
-                TransactionModel.account_for_id == AccountModel.id,
+                TransactionAggregateModel.account_for_id == AccountModel.id,
             )
             .where(
-                TransactionModel.period_id == self.period_id,
+                TransactionAggregateModel.period_id == self.period_id,
                 self._filter_accounts(),
             )
             .group_by(
-                TransactionModel.account_for_id,
+                TransactionAggregateModel.account_for_id,
             )
         )
-        return self.sess.execute(query).mappings().all()
+        return query
 
-    def get_history(self) -> list[dict]:
+    def get_account_for_total(self) -> list[dict]:
+        return self.sess.execute(self._account_for_total_query()).mappings().all()
+
+    def _history_query(self) -> Select:
         query = (
             select(
                 PeriodModel.id,
                 PeriodModel.period_start,
-                func.sum(TransactionModel.amount).label("amount"),
+                func.sum(TransactionAggregateModel.amount).label("amount"),
             )
             .select_from(PeriodModel)
-            .outerjoin(TransactionModel)
+            .outerjoin(
+                TransactionAggregateModel,
+                TransactionAggregateModel.period_id == PeriodModel.id,
+            )
             .where(
                 PeriodModel.period_start >= self.period.replace(year=self.period.year-1),
                 PeriodModel.period_start <= self.period,
@@ -201,23 +299,30 @@ class SummaryMetrics:
                 PeriodModel.period_start,
             )
         )
-        return self.sess.execute(query).mappings().all()
+        return query
+
+    def get_history(self) -> list[dict]:
+        return self.sess.execute(self._history_query()).mappings().all()
 
 
 @dataclass
 class SummaryPlot:
+    """
+    Chart renderer. Figures are created with the object-oriented API rather than pyplot, so they
+    are not registered globally and are freed once rendered. Instances hold no state, so charts can
+    be rendered in worker processes
+    """
     out_format: str = "png"
 
-    def _make_plot(self, fig) -> str:
+    def _make_plot(self, fig: Figure) -> str:
         """
-        Create a binary image useable by the Web application
+        Create a base64-encoded image useable by the Web application
         """
         with io.BytesIO() as cur_file:
-            _ = fig.savefig(cur_file, format="png")
-            cur_file.seek(0)
-            result = cur_file.read()
+            fig.savefig(cur_file, format=self.out_format)
+            result = base64.b64encode(cur_file.getbuffer()).decode("ascii")
 
-        result = base64.b64encode(result).decode("utf-8")
+        fig.clear()
         return result
 
     def _reshape(self, data: list[dict]) -> dict[str, list]:
@@ -232,6 +337,13 @@ class SummaryPlot:
         }
         return result
 
+    @staticmethod
+    def _amounts(data: dict[str, list], target: str) -> list:
+        """
+        Values of a column with missing amounts, e.g. of periods without transactions, as zero
+        """
+        return [value or 0 for value in data.get(target, [])]
+
     def make_linechart(
         self,
         data: dict,
@@ -247,10 +359,12 @@ class SummaryPlot:
         Create the graph and output it PNG format as a bytes object
         """
         data = self._reshape(data)
-        y_max = y_max or (float(max(data[target]))) if data else 1
+        values = self._amounts(data, target)
+        y_max = y_max or float(max(values, default=0)) or 1
 
-        fig, ax = plt.subplots(layout="constrained")
-        ax.plot(data.get(period, []), data.get(target, []))
+        fig = Figure(layout="constrained")
+        ax = fig.add_subplot()
+        ax.plot(data.get(period, []), values)
 
         ax.grid(visible=True, which="major", axis="both")
         ax.set_xlabel(x_label or period)
@@ -273,10 +387,12 @@ class SummaryPlot:
         y_max: int = None,
     ) -> bytes:
         data = self._reshape(data)
-        y_max = y_max or (float(max(data[target]))) if data else 1
+        values = self._amounts(data, target)
+        y_max = y_max or float(max(values, default=0)) or 1
 
-        fig, ax = plt.subplots(layout="constrained")
-        ax.bar(data.get(category, []), data.get(target, []), align="center")
+        fig = Figure(layout="constrained")
+        ax = fig.add_subplot()
+        ax.bar(data.get(category, []), values, align="center")
         ax.set_xlabel(x_label or category)
         ax.set_ylabel(y_label or target)
         ax.set(
@@ -0,0 +1,151 @@
+"""
+Tests of the report server routes
+"""
+
+import datetime as dt
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from finance_tracker.managers import (
+    AccountManager,
+    CategoryManager,
+    PeriodManager,
+    SubcategoryManager,
+    TransactionManager,
+)
+from finance_tracker.models import BaseModel
+from finance_tracker.report.app import (
+    create_app,
+    get_accounts,
+    get_engine,
+    get_periods,
+    start_warm_up,
+)
+
+
+class SummaryRoutesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = tempfile.NamedTemporaryFile()
+        self.engine = create_engine(f"sqlite:///{self.db.name}")
+        BaseModel.metadata.create_all(self.engine)
+        AccountManager(self.engine).create(name="me")
+        CategoryManager(self.engine).create(name="cat")
+        SubcategoryManager(self.engine).create(name="sub", category_id=1)
+        self.row = {
+            "account_id": 1,
+            "category_id": 1,
+            "subcategory_id": 1,
+            "transaction_date": "2024-01-01",
+        }
+        TransactionManager(self.engine).create(**self.row, amount="10.25")
+        self.app = create_app(lambda: self.engine)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.db.close()
+
+    def test_summary_page(self):
+        response = self.client.get("/summary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"/api/summary/?period=1", response.data)
+        self.assertNotIn(b"base64", response.data)
+
+    def test_api(self):
+        response = self.client.get("/api/summary/?period=1&account=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["totals"]["current"], 10.25)
+        self.assertEqual(response.json["period"], "2024-01-01")
+        self.assertEqual(response.json["history"][0]["period_start"], "2024-01-01")
+        self.assertEqual(response.json["top_categories"][0]["name"], "cat")
+        self.assertTrue(response.headers["Cache-Control"].startswith("no-cache"))
+
+    def test_api_not_modified(self):
+        etag = self.client.get("/api/summary/?period=1").get_etag()[0]
+        response = self.client.get("/api/summary/?period=1", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        #   Changed by a write
+        TransactionManager(self.engine).create(**self.row, amount=1)
+        response = self.client.get("/api/summary/?period=1", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+    def test_etag_across_workers(self):
+        #   Another engine has another process-local data version, like another worker
+        other = create_engine(f"sqlite:///{self.db.name}")
+        client = create_app(lambda: other).test_client()
+        for url in ("/api/summary/?period=1", "/summary/charts/history.png?period=1"):
+            etag = self.client.get(url).get_etag()[0]
+            response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(response.status_code, 304)
+        other.dispose()
+
+    def test_stats(self):
+        self.client.get("/api/summary/?period=1")
+        self.client.get("/api/summary/?period=1")
+        result = self.client.get("/api/stats/").json
+        self.assertEqual(result["summary_cache"]["hits"], 1)
+        self.assertEqual(result["summary_flights"]["calls"], 1)
+
+    def test_lookups(self):
+        self.client.get("/summary/")
+        self.client.get("/summary/")
+        result = self.client.get("/api/stats/").json
+        #   Accounts and periods are read once
+        self.assertEqual(result["lookups"], {"size": 2, "hits": 2, "misses": 2})
+
+        AccountManager(self.engine).create(name="you")
+        self.assertEqual(get_accounts(self.engine), {1: "me", 2: "you"})
+        TransactionManager(self.engine).create(
+            **{**self.row, "transaction_date": "2024-02-01"},
+            amount=1,
+        )
+        self.assertEqual(list(get_periods(self.engine).values()), ["2024-01-01", "2024-02-01"])
+
+    def test_warm_up(self):
+        TransactionManager(self.engine).create(
+            **{**self.row, "transaction_date": "2023-12-01"},
+            amount=1,
+        )
+        start_warm_up(self.app, periods=2).join()
+        self.client.get("/summary/")
+        self.client.get("/api/summary/?period=2")
+        self.client.get("/summary/charts/history.png?period=1")
+        result = self.client.get("/api/stats/").json
+        #   Two summaries and the charts of the latest period
+        self.assertEqual(result["summary_flights"]["calls"], 3)
+        self.assertEqual(result["summary_cache"]["size"], 3)
+
+    def test_warm_up_empty_period(self):
+        PeriodManager(self.engine).ensure_periods(dt.date(2024, 1, 1), dt.date(2024, 3, 1))
+        start_warm_up(self.app, periods=3).join()
+        result = self.client.get("/api/stats/").json
+        #   Three summaries and the charts of the latest period, which has no transactions
+        self.assertEqual(result["summary_flights"]["calls"], 4)
+        for name in ("history", "account_for"):
+            response = self.client.get(f"/summary/charts/{name}.png?period=3")
+            self.assertEqual(response.status_code, 200)
+
+    def test_chart(self):
+        response = self.client.get("/summary/charts/history.png?period=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertTrue(response.data.startswith(b"\x89PNG"))
+        self.assertEqual(self.client.get("/summary/charts/other.png").status_code, 404)
+
+
+class CreateAppTestCase(unittest.TestCase):
+    def test_engine_per_process(self):
+        engines = []
+        app = create_app(lambda: engines.append(create_engine("sqlite://")) or engines[-1])
+        with app.app_context():
+            self.assertIs(get_engine(), get_engine())
+
+            #   As seen by a forked worker
+            app.extensions["finance_tracker"]["pid"] = -1
+            self.assertIsNot(get_engine(), engines[0])
+        self.assertEqual(len(engines), 2)
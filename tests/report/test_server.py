@@ -0,0 +1,65 @@
+"""
+Tests of the production report server
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+
+from sqlalchemy import create_engine
+import pytest
+
+from finance_tracker.managers import AccountManager
+from finance_tracker.models import BaseModel
+from finance_tracker.report.server import split_bind
+
+
+class SplitBindTestCase(unittest.TestCase):
+    def test_split_bind(self):
+        self.assertEqual(split_bind("0.0.0.0:8000"), ("0.0.0.0", 8000))
+        self.assertEqual(split_bind(":8000"), ("127.0.0.1", 8000))
+        with self.assertRaises(ValueError):
+            split_bind("localhost")
+
+
+@pytest.mark.integtest
+class ServeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = tempfile.NamedTemporaryFile()
+        engine = create_engine(f"sqlite:///{self.db.name}")
+        BaseModel.metadata.create_all(engine)
+        AccountManager(engine).create(name="me")
+        engine.dispose()
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_workers(self):
+        process = subprocess.Popen([
+            sys.executable, "-m", "finance_tracker", "-d", self.db.name,
+            "report", "--workers", "2", "--threads", "2", "--bind", f"127.0.0.1:{self.port}",
+            "--warm-up", "1",
+        ])
+        try:
+            for _ in range(100):
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/") as response:
+                        self.assertEqual(response.status, 200)
+                    break
+                except OSError:
+                    time.sleep(0.2)
+            else:
+                self.fail("Server did not start")
+        finally:
+            os.kill(process.pid, signal.SIGTERM)
+            self.assertEqual(process.wait(timeout=60), 0)
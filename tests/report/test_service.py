@@ -0,0 +1,132 @@
+"""
+Tests of the cached summary report service
+"""
+
+import tempfile
+from threading import Event, Thread
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+
+from finance_tracker.managers import (
+    AccountManager,
+    CategoryManager,
+    SubcategoryManager,
+    TransactionManager,
+)
+from finance_tracker.models import BaseModel
+from finance_tracker.report.service import (
+    SummaryKey,
+    compute_summary,
+    create_query_pool,
+    create_render_pool,
+    get_charts,
+    get_summary,
+    render_charts,
+    submit_summary,
+    summary_cache,
+    summary_flights,
+)
+
+
+class GetSummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = tempfile.NamedTemporaryFile()
+        self.engine = create_engine(f"sqlite:///{self.db.name}")
+        BaseModel.metadata.create_all(self.engine)
+        AccountManager(self.engine).create(name="me")
+        CategoryManager(self.engine).create(name="cat")
+        SubcategoryManager(self.engine).create(name="sub", category_id=1)
+        self.row = {
+            "account_id": 1,
+            "category_id": 1,
+            "subcategory_id": 1,
+            "transaction_date": "2024-01-01",
+        }
+        TransactionManager(self.engine).create(**self.row, amount=10)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.db.close()
+
+    def get_summary(self, **kwargs):
+        with patch(
+            "finance_tracker.report.service.compute_summary",
+            side_effect=compute_summary,
+        ) as compute:
+            key = SummaryKey.current(self.engine, period_id=1, **kwargs)
+            result = get_summary(self.engine, key)
+        return result, compute.call_count
+
+    def test_cached(self):
+        first, computed = self.get_summary(account_ids=[1])
+        self.assertEqual(computed, 1)
+        self.assertEqual(first["totals"]["current"], 10)
+        self.assertEqual(first["history"][0]["amount"], 10)
+
+        again, computed = self.get_summary(account_ids=[1, 1])
+        self.assertEqual(computed, 0)
+        self.assertIs(again, first)
+        self.assertEqual(summary_cache(self.engine).hits, 1)
+
+    def test_invalidated_by_write(self):
+        self.get_summary()
+        TransactionManager(self.engine).create(**self.row, amount=5)
+        result, computed = self.get_summary()
+        self.assertEqual(computed, 1)
+        self.assertEqual(result["totals"]["current"], 15)
+
+    def test_invalidated_by_other_connection(self):
+        self.get_summary()
+        other = create_engine(f"sqlite:///{self.db.name}")
+        TransactionManager(other).create(**self.row, amount=5)
+        other.dispose()
+
+        result, computed = self.get_summary()
+        self.assertEqual(computed, 1)
+        self.assertEqual(result["totals"]["current"], 15)
+
+    def test_key(self):
+        key = SummaryKey.current(self.engine, period_id=1, account_ids=[2, 1])
+        self.assertEqual(key, SummaryKey.current(self.engine, 1, [1, 2]))
+        TransactionManager(self.engine).create(**self.row, amount=5)
+        self.assertNotEqual(key, SummaryKey.current(self.engine, 1, [1, 2]))
+
+    def test_query_pool(self):
+        key = SummaryKey.current(self.engine, account_ids=[1])
+        with create_query_pool(2) as executor:
+            result = compute_summary(self.engine, key, executor)
+        self.assertEqual(result, compute_summary(self.engine, key))
+        self.assertEqual(result["period_id"], 1)
+
+    def test_charts(self):
+        key = SummaryKey.current(self.engine, period_id=1)
+        with create_query_pool(2) as query_executor, create_render_pool(1) as render_executor:
+            result = get_charts(self.engine, key, query_executor, render_executor)
+        expected = render_charts(submit_summary(self.engine, key))
+        self.assertEqual(result["history"][:64], expected["history"][:64])
+
+        #   The data of the charts is cached as well
+        _, computed = self.get_summary()
+        self.assertEqual(computed, 0)
+
+    def test_coalesced(self):
+        key = SummaryKey.current(self.engine, period_id=1)
+        release = Event()
+
+        def compute(*args):
+            release.wait()
+            return compute_summary(*args)
+
+        with patch("finance_tracker.report.service.compute_summary", side_effect=compute) as mock:
+            threads = [Thread(target=get_summary, args=(self.engine, key)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            while summary_flights(self.engine).coalesced < 2:
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mock.call_count, 1)
@@ -0,0 +1,68 @@
+"""
+Tests of request coalescing
+"""
+
+from threading import Event, Thread
+import time
+import unittest
+
+from finance_tracker.report.singleflight import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = Event()
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("Condition not reached")
+
+    def run_callers(self, count: int, function) -> list:
+        results = [None] * count
+
+        def call(index):
+            try:
+                results[index] = self.flights.do("key", function)
+            except Exception as ex:
+                results[index] = ex
+
+        threads = [Thread(target=call, args=(index, )) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        self.wait_for(lambda: self.flights.coalesced == count - 1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        def compute():
+            self.release.wait()
+            return object()
+
+        results = self.run_callers(5, compute)
+        self.assertTrue(all(item is results[0] for item in results))
+        self.assertEqual((self.flights.calls, self.flights.coalesced), (1, 4))
+        self.assertEqual(len(self.flights), 0)
+
+        #   A new call after the flight landed
+        self.assertEqual(self.flights.do("key", lambda: 1), 1)
+        self.assertEqual(self.flights.calls, 2)
+
+    def test_exception(self):
+        def compute():
+            self.release.wait()
+            raise ValueError("failed")
+
+        results = self.run_callers(3, compute)
+        self.assertTrue(all(isinstance(item, ValueError) for item in results))
+        self.assertEqual(len(self.flights), 0)
+
+    def test_separate_keys(self):
+        self.assertEqual(self.flights.do("one", lambda: 1), 1)
+        self.assertEqual(self.flights.do("two", lambda: 2), 2)
+        self.assertEqual((self.flights.calls, self.flights.coalesced), (2, 0))
@@ -2,9 +2,13 @@
 Tests of the summary report
 """
 
+import base64
 from decimal import Decimal
+import sys
 import unittest
 
+import matplotlib.pyplot as plt
+import pytest
 from sqlalchemy import create_engine, select, func
 from sqlalchemy.orm import Session
 
@@ -12,7 +16,7 @@ from finance_tracker.report.summary import (
     SummaryMetrics,
     SummaryPlot,
 )
-from finance_tracker.models import BaseModel
+from finance_tracker.models import BaseModel, TransactionAggregateModel
 from finance_tracker.managers import (
     AccountManager,
     PeriodManager,
@@ -65,7 +69,7 @@ class SummaryMetricsTestCase(unittest.TestCase):
 
     def test_filter_accounts(self):
         #   All
-        model = self.transaction_manager.model
+        model = TransactionAggregateModel
         metrics = SummaryMetrics(self.sess)
         query = select(func.sum(model.amount)).where(metrics._filter_accounts())
         result = self.sess.execute(query).scalar()
@@ -95,6 +99,25 @@ class SummaryMetricsTestCase(unittest.TestCase):
         self.assertEqual(metrics.previous_month_total(), 25)
         self.assertEqual(metrics.previous_year_total(), 12.5)
 
+    def test_combined_totals(self):
+        metrics = SummaryMetrics(self.sess)
+        self.assertEqual(metrics.totals(), {
+            "current": Decimal(50),
+            "previous_month": Decimal(25),
+            "previous_year": Decimal("12.5"),
+            "month_over_month": Decimal(25),
+            "month_over_month_pct": Decimal(100),
+            "year_over_year": Decimal("37.5"),
+            "year_over_year_pct": Decimal(300),
+        })
+
+        #   Account for id = 1 only has the current month
+        metrics = SummaryMetrics(self.sess, account_for_ids=[1])
+        result = metrics.totals()
+        self.assertEqual(result["previous_month"], 0)
+        self.assertEqual(result["month_over_month"], 50)
+        self.assertIsNone(result["month_over_month_pct"])
+
 
 class SummaryPlotTestCase(unittest.TestCase):
     @classmethod
@@ -117,3 +140,29 @@ class SummaryPlotTestCase(unittest.TestCase):
 
     def test_make_barplot(self):
         _ = self.plot.make_barplot(self.box_data, category="category", target="target")
+
+    def test_no_global_figures(self):
+        result = self.plot.make_linechart(self.box_data, period="category", target="target")
+        self.assertTrue(base64.b64decode(result).startswith(b"\x89PNG"))
+        self.assertEqual(plt.get_fignums(), [])
+
+
+@pytest.mark.integtest
+class SummaryPlotSoakTestCase(unittest.TestCase):
+    @unittest.skipUnless(sys.platform == "linux", "Peak memory is measured in kilobytes on Linux")
+    def test_flat_memory(self):
+        import resource
+
+        plot = SummaryPlot()
+        data = [{"category": f"item {i}", "target": i} for i in range(12)]
+
+        def render(count: int) -> int:
+            for _ in range(count):
+                plot.make_barplot(data, category="category", target="target")
+                plot.make_linechart(data, period="category", target="target")
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        #   Warm up font and glyph caches first
+        baseline = render(50)
+        peak = render(1000)
+        self.assertLess(peak - baseline, 20 * 1024)
@@ -2,12 +2,14 @@
 Tests for argparse module
 """
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import unittest
 
 from finance_tracker.argparse import (
     Parser,
+    process_aggregates,
     process_data,
+    process_list,
 )
 
 
@@ -71,3 +73,86 @@ class ArgumentParserTestCase(unittest.TestCase):
                 {"subcategory_id": "31"},
             ],
         )
+
+    def test_options_before_data(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args([
+            "create",
+            "transaction",
+            "--file",
+            "receipts.csv",
+            "account_id=1",
+        ])
+        self.assertEqual(result.file, "receipts.csv")
+        self.assertEqual(result.data, [{"account_id": "1"}])
+
+    def test_order_by_descending(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args(
+            ["query", "transaction", "--order-by=-transaction_date", "--limit", "50"],
+        )
+        self.assertEqual((result.order_by, result.limit), ("-transaction_date", 50))
+
+    def test_where(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args([
+            "update",
+            "transaction",
+            "--where",
+            "business_id=5",
+            "category_id=3",
+            "-w",
+            "amount__gt=1",
+        ])
+        self.assertEqual(result.where, [{"business_id": "5"}, {"amount__gt": "1"}])
+        self.assertEqual(result.data, [{"category_id": "3"}])
+
+    def test_db_profile(self):
+        parser = Parser().get_parser()
+        self.assertEqual(parser.parse_args(["report"]).db_profile, "safe")
+        self.assertEqual(parser.parse_args(["report", "--db-profile", "fast"]).db_profile, "fast")
+        self.assertEqual(parser.parse_args(["--db-profile", "fast", "report"]).db_profile, "fast")
+
+    def test_report_server(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args(["report"])
+        self.assertEqual((result.workers, result.threads, result.bind), (0, 4, "127.0.0.1:5000"))
+        result = parser.parse_args(["report", "-w", "3", "-t", "8", "-b", "0.0.0.0:8000"])
+        self.assertEqual((result.workers, result.threads, result.bind), (3, 8, "0.0.0.0:8000"))
+
+    def test_aggregation(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args([
+            "query",
+            "transaction",
+            "--group-by",
+            "category_id, period_id",
+            "--agg",
+            "sum:amount,count:id",
+        ])
+        self.assertEqual(result.group_by, ["category_id", "period_id"])
+        self.assertEqual(result.agg, [("sum", "amount"), ("count", "id")])
+
+    def test_aggregation_filters(self):
+        parser = Parser().get_parser()
+        result = parser.parse_args([
+            "query",
+            "transaction",
+            "--group-by",
+            "category_id",
+            "--agg",
+            "sum:amount,count:id",
+            "transaction_date__ge=2024-01-01",
+        ])
+        self.assertEqual(result.group_by, ["category_id"])
+        self.assertEqual(result.data, [{"transaction_date__ge": "2024-01-01"}])
+
+
+class ProcessAggregatesTestCase(unittest.TestCase):
+    def test_process_list(self):
+        self.assertEqual(process_list("a, b,,c"), ["a", "b", "c"])
+
+    def test_process_aggregates(self):
+        self.assertEqual(process_aggregates("sum:amount"), [("sum", "amount")])
+        with self.assertRaises(ArgumentTypeError):
+            process_aggregates("sum")
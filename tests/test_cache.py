@@ -0,0 +1,105 @@
+"""
+Tests for in-process caches
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+import time
+import unittest
+
+from sqlalchemy import create_engine
+
+from finance_tracker.cache import (
+    LRUCache,
+    VersionedCache,
+    clear_caches,
+    data_version,
+    get_cache,
+)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("one", 1)
+        cache.set("two", 2)
+        self.assertEqual(cache.get("one"), 1)
+        cache.set("three", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("two", cache)
+        self.assertIn("one", cache)
+
+    def test_counters(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get("one"))
+        cache.set("one", 1)
+        self.assertEqual(cache.get("one"), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_bad_size(self):
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class VersionedCacheTestCase(unittest.TestCase):
+    def test_version(self):
+        cache = VersionedCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return len(loads)
+
+        self.assertEqual(cache.get("key", (1,), load), 1)
+        self.assertEqual(cache.get("key", (1,), load), 1)
+        self.assertEqual(cache.get("key", (2,), load), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        cache.clear()
+        self.assertEqual(cache.get("key", (2,), load), 3)
+
+
+class GetCacheTestCase(unittest.TestCase):
+    def test_per_engine(self):
+        engine = create_engine("sqlite:///:memory:")
+        other = create_engine("sqlite:///:memory:")
+        get_cache(engine, "test")["key"] = "value"
+        self.assertIs(get_cache(engine, "test"), get_cache(engine, "test"))
+        self.assertEqual(get_cache(other, "test"), {})
+
+        clear_caches(engine)
+        self.assertEqual(get_cache(engine, "test"), {})
+
+    def test_concurrent_creation(self):
+        engine = create_engine("sqlite:///:memory:")
+        barrier = Barrier(8)
+        created = []
+
+        def factory():
+            created.append(1)
+            time.sleep(0.01)
+            return object()
+
+        def get():
+            barrier.wait()
+            return get_cache(engine, "test", factory)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            result = list(executor.map(lambda _: get(), range(8)))
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(item is result[0] for item in result))
+
+
+class DataVersionTestCase(unittest.TestCase):
+    def test_commit(self):
+        engine = create_engine("sqlite:///:memory:")
+        version = data_version(engine)
+        self.assertEqual(data_version(engine), version)
+
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE test (id INTEGER)")
+        self.assertNotEqual(data_version(engine), version)
+
+        version = data_version(engine)
+        clear_caches(engine)
+        self.assertNotEqual(data_version(engine), version)
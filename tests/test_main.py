@@ -2,10 +2,11 @@
 Main unit tests
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 import tempfile
 from types import SimpleNamespace
 import unittest
+from unittest.mock import patch
 
 from finance_tracker.main import (
     DBHandler,
@@ -14,8 +15,12 @@ from finance_tracker.main import (
 from finance_tracker.managers import (
     CategoryManager,
     AccountManager,
+    SubcategoryManager,
+    TransactionManager,
 )
 from finance_tracker.models import (
+    SCHEMA_VERSION,
+    AccountModel,
     BaseModel,
     TransactionModel,
 )
@@ -41,6 +46,106 @@ class DBHandlerTestCase(unittest.TestCase):
         )
 
 
+class UpgradeSchemaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite+pysqlite:///:memory:")
+        BaseModel.metadata.create_all(self.engine)
+
+    def test_upgrade_schema(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_transaction_period_id")
+            conn.exec_driver_sql("DROP INDEX ix_period_period_start")
+
+        DBHandler.upgrade_schema(self.engine)
+        DBHandler.upgrade_schema(self.engine)
+        indexes = {
+            item["name"]
+            for table in ("transaction", "period")
+            for item in inspect(self.engine).get_indexes(table)
+        }
+        self.assertIn("ix_transaction_period_id", indexes)
+        self.assertIn("ix_period_period_start", indexes)
+
+    def get_version(self):
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    def test_new_schema_version(self):
+        self.assertEqual(self.get_version(), SCHEMA_VERSION)
+        DBHandler.upgrade_schema(self.engine)
+        self.assertEqual(self.get_version(), SCHEMA_VERSION)
+
+    def test_migrate_amounts(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.exec_driver_sql(
+                'INSERT INTO "transaction" (code, amount, account_id, account_for_id, '
+                "category_id, subcategory_id, period_id) VALUES ('a', 12.34, 1, 1, 1, 1, 1)"
+            )
+            conn.exec_driver_sql("PRAGMA user_version = 0")
+
+        DBHandler.upgrade_schema(self.engine)
+        DBHandler.upgrade_schema(self.engine)
+        with self.engine.connect() as conn:
+            result = conn.exec_driver_sql('SELECT amount FROM "transaction"').scalar()
+        self.assertEqual(result, 1234)
+        self.assertEqual(self.get_version(), SCHEMA_VERSION)
+
+    def test_migrate_dangling_foreign_keys(self):
+        #   Businesses could be deleted while transactions referred to them
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.exec_driver_sql(
+                'INSERT INTO "transaction" (code, amount, account_id, account_for_id, '
+                "category_id, subcategory_id, business_id, period_id) "
+                "VALUES ('a', 1234, 1, 1, 1, 1, 99, 1)"
+            )
+            conn.exec_driver_sql("PRAGMA user_version = 1")
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+
+        with self.assertLogs("finance_tracker.main", "WARNING") as logs:
+            DBHandler.upgrade_schema(self.engine)
+        self.assertIn("refer to missing business rows", "\n".join(logs.output))
+        self.assertEqual(self.get_version(), SCHEMA_VERSION)
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql(
+                "SELECT business_id, amount FROM transaction_aggregate"
+            ).one()
+            self.assertEqual(tuple(row), (99, 1234))
+            self.assertEqual(conn.exec_driver_sql("PRAGMA foreign_keys").scalar(), 1)
+        self.assertEqual(TransactionManager(self.engine).refresh_aggregates(), 1)
+
+
+class DBHandlerProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = tempfile.NamedTemporaryFile()
+
+    def tearDown(self):
+        self.db.close()
+
+    def get_pragma(self, engine, name):
+        with engine.connect() as conn:
+            return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_safe(self):
+        engine = DBHandler(self.db.name).engine
+        self.assertEqual(self.get_pragma(engine, "journal_mode"), "wal")
+        self.assertEqual(self.get_pragma(engine, "synchronous"), 2)
+        self.assertEqual(self.get_pragma(engine, "foreign_keys"), 1)
+
+    def test_fast(self):
+        engine = DBHandler(self.db.name, profile="fast").engine
+        self.assertEqual(self.get_pragma(engine, "journal_mode"), "wal")
+        self.assertEqual(self.get_pragma(engine, "synchronous"), 1)
+        self.assertEqual(self.get_pragma(engine, "temp_store"), 2)
+        self.assertEqual(self.get_pragma(engine, "busy_timeout"), 5000)
+
+    def test_bad_profile(self):
+        with self.assertRaises(ValueError):
+            DBHandler(self.db.name, profile="bla")
+
+
 class MainTestCase(unittest.TestCase):
     def setUp(self):
         self.db = tempfile.NamedTemporaryFile()
@@ -121,6 +226,169 @@ class MainTestCase(unittest.TestCase):
         self.assertIsInstance(result[0], TransactionModel)
         self.assertAlmostEqual(float(result[0].amount), 12.54)
 
+    def test_main_query_pages(self):
+        AccountManager(self.engine).create_many({"name": f"acc{index}"} for index in range(5))
+        with patch("builtins.print") as mock_print:
+            result = main(
+                SimpleNamespace(
+                    database=self.db.name,
+                    action="query",
+                    object="account",
+                    limit=3,
+                    offset=0,
+                    after=None,
+                    verbose=False,
+                    data=[],
+                )
+            )
+        self.assertEqual([item.id for item in result], [1, 2, 3])
+        token = mock_print.call_args.args[0].removeprefix("Next page: --after ")
+
+        result = main(
+            SimpleNamespace(
+                database=self.db.name,
+                action="query",
+                object="account",
+                limit=3,
+                offset=0,
+                after=token,
+                verbose=False,
+                data=[],
+            )
+        )
+        self.assertEqual([item.id for item in result], [4, 5])
+
+    def test_main_create_from_file(self):
+        AccountManager(self.engine).create(name="test_acc")
+        CategoryManager(self.engine).create(name="test_cat")
+        SubcategoryManager(self.engine).create_many(
+            [{"name": "test_sub", "category_id": 1}, {"name": "other_sub", "category_id": 1}],
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as cur_file:
+            cur_file.write(
+                "amount,transaction_date,subcategory_id\n"
+                "12.54,2024-01-01,1\n"
+                "3.10,2024-02-01,\n"
+            )
+            cur_file.flush()
+            result = main(
+                SimpleNamespace(
+                    database=self.db.name,
+                    action="create",
+                    object="transaction",
+                    qr_code=False,
+                    file=cur_file.name,
+                    batch_size=1,
+                    verbose=False,
+                    data=[{"account_id": 1}, {"category_id": 1}, {"subcategory_id": 2}],
+                )
+            )
+
+        self.assertEqual(result, [1, 2])
+        transactions = TransactionManager(self.engine).query()
+        self.assertEqual([item.subcategory_id for item in transactions], [1, 2])
+
+    def test_main_query_stream(self):
+        AccountManager(self.engine).create_many({"name": f"acc{index}"} for index in range(5))
+        with patch("builtins.print") as mock_print:
+            result = main(
+                SimpleNamespace(
+                    database=self.db.name,
+                    action="query",
+                    object="account",
+                    limit=0,
+                    offset=1,
+                    after=None,
+                    stream=True,
+                    verbose=False,
+                    data=[],
+                )
+            )
+        self.assertEqual(result, 4)
+        rows = [
+            item.args[0]
+            for item in mock_print.call_args_list
+            if isinstance(item.args[0], AccountModel)
+        ]
+        self.assertEqual([item.name for item in rows], ["acc1", "acc2", "acc3", "acc4"])
+
+    def test_main_update_where(self):
+        AccountManager(self.engine).create_many({"name": f"acc{index}"} for index in range(5))
+        result = main(
+            SimpleNamespace(
+                database=self.db.name,
+                action="update",
+                object="account",
+                where=[{"id__ge": "3"}, {"name__like": "acc%"}],
+                verbose=False,
+                data=[{"name": "renamed"}],
+            )
+        )
+        self.assertEqual(result, 3)
+        result = main(
+            SimpleNamespace(
+                database=self.db.name,
+                action="delete",
+                object="account",
+                where=[{"name": "renamed"}],
+                verbose=False,
+                data=[],
+            )
+        )
+        self.assertEqual(result, 3)
+        self.assertEqual(
+            [item.name for item in AccountManager(self.engine).query()],
+            ["acc0", "acc1"],
+        )
+
+        with self.assertRaises(ValueError):
+            main(
+                SimpleNamespace(
+                    database=self.db.name,
+                    action="update",
+                    object="account",
+                    where=[{"name": "acc0"}],
+                    verbose=False,
+                    data=[],
+                )
+            )
+
+    def test_main_explain(self):
+        AccountManager(self.engine).create(name="test_acc")
+        CategoryManager(self.engine).create(name="test_cat")
+        SubcategoryManager(self.engine).create(name="test_sub", category_id=1)
+        TransactionManager(self.engine).create(
+            amount=1, account_id=1, category_id=1, subcategory_id=1,
+        )
+        result = main(SimpleNamespace(database=self.db.name, action="explain", verbose=False))
+        self.assertIn("top_businesses", result)
+        self.assertTrue(
+            any("ix_transaction_aggregate_key" in item for item in result["top_businesses"])
+        )
+
+    def test_main_explain_empty(self):
+        result = main(SimpleNamespace(database=self.db.name, action="explain", verbose=False))
+        self.assertIn("totals", result)
+
+    def test_main_rebuild_aggregates(self):
+        AccountManager(self.engine).create(name="test_acc")
+        CategoryManager(self.engine).create(name="test_cat")
+        SubcategoryManager(self.engine).create(name="test_sub", category_id=1)
+        TransactionManager(self.engine).create_many([
+            {"amount": 1, "account_id": 1, "category_id": 1, "subcategory_id": 1},
+            {"amount": 2, "account_id": 1, "category_id": 1, "subcategory_id": 1},
+        ])
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM transaction_aggregate")
+
+        args = SimpleNamespace(database=self.db.name, action="rebuild-aggregates", verbose=False)
+        with patch("builtins.print"):
+            result = main(args)
+        self.assertEqual(result, 1)
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql("SELECT amount, count FROM transaction_aggregate").one()
+        self.assertEqual(tuple(row), (300, 2))
+
     def test_main_qr_code_flow(self):
         #   TODO
         pass
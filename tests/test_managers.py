@@ -2,18 +2,23 @@
 Unit tests for application logic
 """
 
+from collections.abc import Iterator
 import datetime as dt
+from decimal import Decimal
 import unittest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, delete, event, select
 from sqlalchemy.orm import (
     Mapped,
     Session,
 )
 
+from finance_tracker.cache import get_cache
 from finance_tracker.models import (
     BaseModel,
     BusinessModel,
+    PeriodModel,
+    TransactionAggregateModel,
     TransactionModel,
 )
 from finance_tracker.managers import (
@@ -24,6 +29,7 @@ from finance_tracker.managers import (
     SubcategoryManager,
     PeriodManager,
     TransactionManager,
+    unit_of_work,
 )
 from finance_tracker.qr_handler import QRData
 
@@ -37,6 +43,16 @@ class SomeManager(BaseManager):
     model = SomeModel
 
 
+def page_through(manager, limit, order_by=None, **kwargs):
+    result = []
+    page = manager.query(limit, order_by=order_by, **kwargs)
+    while page:
+        result.extend(page)
+        token = manager.page_token(page[-1], order_by=order_by)
+        page = manager.query(limit, after=token, **kwargs)
+    return result
+
+
 class BaseManagerTestCase(unittest.TestCase):
     def setUp(self):
         self.engine = create_engine("sqlite:///:memory:", echo=False)
@@ -58,6 +74,93 @@ class BaseManagerTestCase(unittest.TestCase):
         self.assertIsInstance(result, SomeModel)
         self.assertEqual(result.value, "bla2")
 
+    def test_create_many(self):
+        result = self.manager.create_many(
+            [{"value": f"bla{index}"} for index in range(5)],
+            batch_size=2,
+        )
+        self.assertEqual(result, [2, 3, 4, 5, 6])
+        self.assertEqual(self.manager.get(6).value, "bla4")
+
+    def test_create_many_bad_batch_size(self):
+        with self.assertRaises(ValueError):
+            self.manager.create_many([{"value": "bla"}], batch_size=0)
+
+    def test_query_order(self):
+        self.manager.create_many([{"value": item} for item in ("c", "a", "b", "a")])
+        result = self.manager.query(order_by="value")
+        self.assertEqual([item.id for item in result], [3, 5, 4, 1, 2])
+        result = self.manager.query(order_by="-value")
+        self.assertEqual([item.id for item in result], [2, 1, 4, 5, 3])
+
+        with self.assertRaises(ValueError):
+            self.manager.query(order_by="bla")
+
+    def test_keyset_pagination(self):
+        self.manager.create_many([{"value": item} for item in ("c", "a", "b", "a", "c", "a")])
+        for order_by in ("id", "-id", "value", "-value"):
+            with self.subTest(order_by=order_by):
+                expected = [item.id for item in self.manager.query(order_by=order_by)]
+                result = [item.id for item in page_through(self.manager, 2, order_by)]
+                self.assertEqual(result, expected)
+
+    def test_query_unbounded(self):
+        self.manager.create_many([{"value": f"bla{index}"} for index in range(150)])
+        self.assertEqual(len(self.manager.query()), 100)
+        self.assertEqual(len(self.manager.query(limit=0)), 151)
+
+    def test_stream(self):
+        self.manager.create_many([{"value": f"bla{index}"} for index in range(20)])
+        result = self.manager.stream(batch_size=3, order_by="-id")
+        self.assertIsInstance(result, Iterator)
+        self.assertEqual([item.id for item in result], list(range(21, 0, -1)))
+        result = self.manager.stream(limit=5, offset=2, batch_size=2)
+        self.assertEqual([item.id for item in result], [3, 4, 5, 6, 7])
+
+    def test_stream_closed_early(self):
+        cache = get_cache(self.engine, "test")
+        cache["key"] = "value"
+        result = self.manager.stream()
+        next(result)
+        result.close()
+        self.assertEqual(cache, {"key": "value"})
+
+    def test_update_many(self):
+        self.manager.create_many([{"value": item} for item in ("a", "b", "a")])
+        bad_date = dt.datetime(2000, 1, 1)
+        result = self.manager.update_many(
+            {"value": "a"},
+            {"value": "changed", "updated_time": bad_date},
+        )
+        self.assertEqual(result, 2)
+        self.assertEqual(
+            [item.value for item in self.manager.query()],
+            ["bla", "changed", "b", "changed"],
+        )
+        self.assertNotEqual(self.manager.get(2).updated_time, bad_date)
+
+        with self.assertRaises(ValueError):
+            self.manager.update_many({"id": 1}, {"updated_time": bad_date})
+        with self.assertRaises(ValueError):
+            self.manager.update_many({}, {"value": "all"})
+        with self.assertRaises(ValueError):
+            self.manager.update_many({"id": 1}, {"bla": "all"})
+
+    def test_delete_many(self):
+        self.manager.create_many([{"value": item} for item in ("a", "b", "c")])
+        self.assertEqual(self.manager.delete_many({"value__in": "a,c", "id__gt": 1}), 2)
+        self.assertEqual([item.value for item in self.manager.query()], ["bla", "b"])
+        with self.assertRaises(ValueError):
+            self.manager.delete_many({})
+
+    def test_bad_token(self):
+        with self.assertRaises(ValueError):
+            self.manager.query(after="bla")
+
+        token = self.manager.encode_token("value", "bla", 1)
+        with self.assertRaises(ValueError):
+            self.manager.query(after=token, order_by="id")
+
     def test_delete(self):
         result = self.manager.delete(id=1)
         self.assertEqual(result.value, "bla")
@@ -73,6 +176,36 @@ class BaseManagerTestCase(unittest.TestCase):
         self.assertNotEqual(result.updated_time, bad_date)
 
 
+class UnitOfWorkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        BaseModel.metadata.create_all(self.engine)
+
+    def test_shared_session(self):
+        with unit_of_work(self.engine) as sess:
+            manager = SomeManager(self.engine, session=sess)
+            created = manager.create(value="bla")
+            self.assertIs(manager.get(created.id), created)
+            updated = manager.update(created.id, value="changed")
+            self.assertIs(updated, created)
+
+        self.assertEqual(SomeManager(self.engine).get(created.id).value, "changed")
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with unit_of_work(self.engine) as sess:
+                SomeManager(self.engine, session=sess).create(value="bla")
+                raise RuntimeError("Abort")
+
+        self.assertEqual(SomeManager(self.engine).query(), [])
+
+    def test_bind(self):
+        with unit_of_work(self.engine) as sess:
+            manager = SomeManager(self.engine).bind(sess)
+            self.assertIs(manager.session, sess)
+            self.assertIs(manager._manager(AccountManager).session, sess)
+
+
 class BusinessManagerTestCase(unittest.TestCase):
     def setUp(self):
         self.engine = create_engine("sqlite:///:memory:")
@@ -96,6 +229,90 @@ class BusinessManagerTestCase(unittest.TestCase):
         self.assertIsInstance(result, BusinessModel)
         self.assertEqual(result.code, "some_code")
 
+    def test_upsert(self):
+        rows = [
+            {"name": f"business{index}", "code": f"code{index}", "default_category_id": 1,
+             "default_subcategory_id": 1}
+            for index in range(4)
+        ]
+        self.assertEqual(self.manager.create_many(rows[:2]), [1, 2])
+        self.assertEqual(self.manager.lookup(code="code1").id, 2)
+
+        rows = [{**item, "name": item["name"].upper()} for item in rows]
+        result = self.manager.create_many(rows[1:], on_conflict="nothing")
+        self.assertEqual(sorted(result), [3, 4])
+        self.assertEqual(self.manager.get(2).name, "business1")
+
+        result = self.manager.create_many(rows, batch_size=3, on_conflict="update")
+        self.assertEqual(sorted(result), [1, 2, 3, 4])
+        self.assertEqual([item.name for item in self.manager.query()], [
+            "BUSINESS0", "BUSINESS1", "BUSINESS2", "BUSINESS3",
+        ])
+        self.assertEqual(self.manager.cache.get(("code", "code1")), None)
+
+        result = self.manager.upsert("nothing", **{**rows[0], "name": "ignored"})
+        self.assertEqual((result.id, result.name), (1, "BUSINESS0"))
+
+        with self.assertRaises(ValueError):
+            self.manager.create_many(rows, on_conflict="bla")
+        with self.assertRaises(ValueError):
+            AccountManager(self.engine).create_many([{"name": "bla"}], on_conflict="update")
+
+    def test_lookup_invalidation_many(self):
+        business = self.manager.create(
+            name="some_business",
+            code="some_code",
+            default_category_id=1,
+            default_subcategory_id=2,
+        )
+        self.assertEqual(self.manager.lookup(code="some_code").default_category_id, 1)
+        self.manager.update_many({"code": "some_code"}, {"default_category_id": "3"})
+        self.assertEqual(self.manager.lookup(code="some_code").default_category_id, 3)
+        self.manager.delete_many({"id": business.id})
+        self.assertIsNone(self.manager.lookup(code="some_code"))
+
+    def test_lookup(self):
+        business = self.manager.create(
+            name="some_business",
+            code="some_code",
+            default_category_id=1,
+            default_subcategory_id=2,
+        )
+        result = self.manager.lookup(code="some_code")
+        self.assertEqual(result.id, business.id)
+        self.assertEqual(result.default_subcategory_id, 2)
+        self.assertEqual(self.manager.cache.misses, 1)
+
+        self.assertEqual(self.manager.lookup(id=str(business.id)), result)
+        self.assertEqual(self.manager.lookup(code="some_code"), result)
+        self.assertEqual(self.manager.cache.hits, 2)
+        self.assertIsNone(self.manager.lookup(code="missing"))
+
+    def test_lookup_invalidation(self):
+        business = self.manager.create(
+            name="some_business",
+            code="some_code",
+            default_category_id=1,
+            default_subcategory_id=2,
+        )
+        self.assertEqual(self.manager.lookup(id=business.id).default_category_id, 1)
+        self.manager.update(business.id, default_category_id=3)
+        self.assertEqual(self.manager.lookup(id=business.id).default_category_id, 3)
+        self.manager.delete(business.id)
+        self.assertIsNone(self.manager.lookup(id=business.id))
+
+    def test_cache_caller_rollback(self):
+        CategoryManager(self.engine).create(name="cat")
+        SubcategoryManager(self.engine).create(name="sub", category_id=1)
+        with Session(self.engine) as sess:
+            manager = self.manager.bind(sess)
+            manager.create(code="B", name="B", default_category_id=1, default_subcategory_id=1)
+            self.assertEqual(manager.lookup(code="B").id, 1)
+            sess.rollback()
+
+        self.assertIsNone(BusinessManager(self.engine).lookup(code="B"))
+        self.assertEqual(len(self.manager.cache), 0)
+
 
 class PeriodTestCase(unittest.TestCase):
     def setUp(self):
@@ -109,6 +326,66 @@ class PeriodTestCase(unittest.TestCase):
         self.assertEqual(result.period_start, dt.date.today().replace(day=1))
         self.assertEqual(result.code, dt.date.today().strftime("%Y%m"))
 
+    def test_get_period_id(self):
+        period_id = self.manager.get_period_id(dt.date(2024, 2, 1))
+        self.assertEqual(self.manager.get(period_id).period_start, dt.date(2024, 2, 1))
+        self.assertEqual(self.manager.cache, {dt.date(2024, 2, 1): period_id})
+
+        #   Served from the cache
+        with Session(self.engine) as sess:
+            sess.execute(PeriodModel.__table__.delete())
+            sess.commit()
+        self.assertEqual(self.manager.get_period_id(dt.date(2024, 2, 1)), period_id)
+
+    def test_cache_invalidation(self):
+        period_id = self.manager.get_period_id(dt.date(2024, 2, 1))
+        self.manager.delete(period_id)
+        self.assertEqual(self.manager.cache, {})
+        self.assertEqual(self.manager.query(), [])
+        period_id = self.manager.get_period_id(dt.date(2024, 2, 1))
+        self.assertEqual(self.manager.get(period_id).period_start, dt.date(2024, 2, 1))
+
+    def test_cache_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with unit_of_work(self.engine) as sess:
+                self.manager.bind(sess).get_period_id(dt.date(2024, 2, 1))
+                raise RuntimeError("Abort")
+
+        self.assertEqual(self.manager.cache, {})
+        self.assertEqual(self.manager.query(), [])
+
+    def test_cache_caller_rollback(self):
+        with Session(self.engine) as sess:
+            manager = self.manager.bind(sess)
+            period_id = manager.get_period_id(dt.date(2023, 5, 1))
+            self.assertEqual(manager.get_period_id(dt.date(2023, 5, 1)), period_id)
+            manager.ensure_periods(dt.date(2023, 6, 1), dt.date(2023, 7, 1))
+            sess.rollback()
+
+        self.assertEqual(self.manager.cache, {})
+        self.assertEqual(self.manager.query(), [])
+
+        with Session(self.engine) as sess:
+            period_id = self.manager.bind(sess).get_period_id(dt.date(2023, 5, 1))
+            self.assertEqual(self.manager.cache, {})
+            sess.commit()
+        self.assertEqual(self.manager.cache, {dt.date(2023, 5, 1): period_id})
+
+    def test_ensure_periods(self):
+        existing = self.manager.create(period_start=dt.date(2024, 3, 1))
+        result = self.manager.ensure_periods(dt.date(2024, 1, 15), dt.date(2024, 12, 31))
+        self.assertEqual(list(result), [dt.date(2024, month, 1) for month in range(1, 13)])
+        self.assertEqual(result[dt.date(2024, 3, 1)], existing.id)
+        self.assertEqual(len(self.manager.query()), 12)
+        february = self.manager.get(result[dt.date(2024, 2, 1)])
+        self.assertEqual(february.period_end, dt.date(2024, 2, 29))
+
+        #   Nothing left to create
+        self.assertEqual(
+            self.manager.ensure_periods(dt.date(2024, 1, 1), dt.date(2024, 12, 1)),
+            result,
+        )
+
 
 class TransactionManagerTestCase(unittest.TestCase):
     def setUp(self):
@@ -169,6 +446,56 @@ class TransactionManagerTestCase(unittest.TestCase):
         self.assertEqual(tran.period_id, new_per.id)
         self.assertAlmostEqual(float(tran.amount), 12.91)
 
+    def test_from_qr_upsert(self):
+        transaction_manager = TransactionManager(self.engine)
+        first = transaction_manager.from_qr_code(
+            qrdata=self.qrdata,
+            account_id=self.account.id,
+            on_conflict="nothing",
+        )
+        again = transaction_manager.from_qr_code(
+            qrdata=self.qrdata,
+            account_id=self.account.id,
+            amount=1,
+            on_conflict="nothing",
+        )
+        self.assertEqual(again.id, first.id)
+        self.assertAlmostEqual(float(again.amount), 59.99)
+
+        updated = transaction_manager.from_qr_code(
+            qrdata=self.qrdata,
+            account_id=self.account.id,
+            amount=1,
+            on_conflict="update",
+        )
+        self.assertEqual(updated.id, first.id)
+        self.assertAlmostEqual(float(updated.amount), 1)
+        self.assertEqual(len(transaction_manager.query()), 1)
+
+    def test_upsert_keeps_derived_values(self):
+        manager = TransactionManager(self.engine)
+        other = AccountManager(self.engine).create(name="other")
+        row = {"code": "X", "account_id": self.account.id, "category_id": 1, "subcategory_id": 1}
+        first = manager.upsert(
+            **row,
+            amount=10,
+            transaction_date="2024-01-05",
+            account_for_id=other.id,
+        )
+
+        #   No date given: the date, period and account for stay as they are
+        updated = manager.upsert(**row, amount=2)
+        self.assertEqual(updated.id, first.id)
+        self.assertEqual(updated.transaction_date, dt.date(2024, 1, 5))
+        self.assertEqual(updated.period_id, first.period_id)
+        self.assertEqual(updated.account_for_id, other.id)
+        self.assertAlmostEqual(float(updated.amount), 2)
+
+        #   A new date moves the transaction to its period
+        updated = manager.upsert(**row, amount=2, transaction_date="2024-03-01")
+        period = PeriodManager(self.engine).get(updated.period_id)
+        self.assertEqual(period.period_start, dt.date(2024, 3, 1))
+
     def test_category_from_business(self):
         result = TransactionManager(self.engine).create(
             account_id=self.account.id,
@@ -200,6 +527,175 @@ class TransactionManagerTestCase(unittest.TestCase):
         self.assertEqual(periods[1].period_start, dt.date(2024, 1, 1))
         self.assertEqual(periods[2].period_start, dt.date(2024, 2, 1))
 
+    def test_create_many(self):
+        transaction_manager = TransactionManager(self.engine)
+        result = transaction_manager.create_many(
+            [
+                {
+                    "account_id": "1",
+                    "amount": "10",
+                    "transaction_date": "2022-01-05",
+                    "category_id": "1",
+                    "subcategory_id": "1",
+                },
+                {
+                    "account_id": "1",
+                    "amount": "20",
+                    "transaction_date": "2024-03-05",
+                    "category_id": "1",
+                    "subcategory_id": "1",
+                },
+                {
+                    "account_id": "1",
+                    "account_for_id": "2",
+                    "amount": "30",
+                    "transaction_date": "2024-03-06",
+                    "business_id": "1",
+                },
+            ],
+            batch_size=2,
+        )
+        self.assertEqual(len(result), 3)
+
+        first, second, third = [transaction_manager.get(item) for item in result]
+        self.assertEqual(first.period_id, self.period.id)
+        self.assertEqual(first.account_for_id, 1)
+        self.assertEqual(second.period_id, third.period_id)
+        self.assertEqual(
+            PeriodManager(self.engine).get(second.period_id).period_start,
+            dt.date(2024, 3, 1),
+        )
+        self.assertEqual(third.account_for_id, 2)
+        self.assertEqual(third.category_id, self.category.id)
+        self.assertEqual(third.subcategory_id, self.subcategory.id)
+        self.assertNotEqual(first.code, second.code)
+
+    def test_query_filters(self):
+        transaction_manager = TransactionManager(self.engine)
+        transaction_manager.create_many(
+            {
+                "account_id": 1,
+                "amount": amount,
+                "category_id": 1,
+                "subcategory_id": 1,
+                "business_id": business_id,
+                "transaction_date": transaction_date,
+            }
+            for amount, business_id, transaction_date in (
+                (10, 1, "2024-01-05"),
+                (150, None, "2024-02-10"),
+                (200, 1, "2024-04-01"),
+                (50, None, None),
+            )
+        )
+
+        def ids(**kwargs):
+            return [item.id for item in transaction_manager.query(**kwargs)]
+
+        self.assertEqual(ids(amount__gt="100"), [2, 3])
+        self.assertEqual(ids(amount__le=50), [1, 4])
+        self.assertEqual(ids(transaction_date__between="2024-01-01,2024-03-31"), [1, 2])
+        self.assertEqual(ids(transaction_date__ge="2024-02-10", business_id="1"), [3])
+        self.assertEqual(ids(business_id__isnull="true"), [2, 4])
+        self.assertEqual(ids(id__in="1,3,4", amount__ne="200"), [1, 4])
+        self.assertEqual(ids(code__like="%", order_by="-amount", limit=1), [3])
+
+        bad_filters = (
+            {"amount__bla": 1},
+            {"bla": 1},
+            {"id__between": "1"},
+            {"id": "one"},
+            {"amount__gt": "abc"},
+        )
+        for bad in bad_filters:
+            with self.subTest(bad=bad):
+                with self.assertRaises(ValueError):
+                    transaction_manager.query(**bad)
+
+    def test_query_aggregates(self):
+        transaction_manager = TransactionManager(self.engine)
+        transaction_manager.create_many(
+            {
+                "account_id": 1,
+                "amount": amount,
+                "category_id": category_id,
+                "subcategory_id": 1,
+                "transaction_date": "2024-01-01",
+            }
+            for amount, category_id in ((10, 1), (20, 2), (30, 2), (500, 1))
+        )
+        result = transaction_manager.query(
+            group_by=["category_id"],
+            aggregates=[("sum", "amount"), ("count", "id")],
+            amount__lt=100,
+        )
+        self.assertEqual(
+            [dict(item) for item in result],
+            [
+                {"category_id": 1, "sum_amount": 10, "count_id": 1},
+                {"category_id": 2, "sum_amount": 50, "count_id": 2},
+            ],
+        )
+
+        result = transaction_manager.query(
+            group_by=["category_id"],
+            aggregates=[("max", "amount")],
+            order_by="-max_amount",
+            limit=1,
+        )
+        self.assertEqual(result[0]["category_id"], 1)
+
+        for bad in (
+            {"group_by": ["bla"]},
+            {"aggregates": [("median", "amount")]},
+            {"aggregates": [("sum", "amount")], "order_by": "amount"},
+            {"aggregates": [("sum", "amount")], "after": "token"},
+        ):
+            with self.subTest(bad=bad):
+                with self.assertRaises(ValueError):
+                    transaction_manager.query(**bad)
+
+    def test_query_expand(self):
+        transaction_manager = TransactionManager(self.engine)
+        transaction_manager.create_many(
+            {"account_id": 1, "amount": index, "business_id": 1} for index in range(20)
+        )
+        statements = []
+        event.listen(
+            self.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        result = transaction_manager.query(expand=["business", "category", "account"])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(result[-1].business.name, "Some business")
+        self.assertEqual(result[-1].category.name, "Daily life")
+        self.assertIn("business='Some business'", repr(result[-1]))
+        self.assertNotIn("period=", repr(result[-1]))
+
+        with self.assertRaises(ValueError):
+            transaction_manager.query(expand=["bla"])
+
+    def test_keyset_pagination_nulls(self):
+        transaction_manager = TransactionManager(self.engine)
+        transaction_manager.create_many(
+            {
+                "account_id": 1,
+                "amount": index,
+                "category_id": 1,
+                "subcategory_id": 1,
+                "business_id": 1 if index % 3 else None,
+                "transaction_date": dt.date(2022, 1, 1) if index % 2 else None,
+            }
+            for index in range(10)
+        )
+        for order_by in ("business_id", "-business_id", "transaction_date", "-transaction_date"):
+            with self.subTest(order_by=order_by):
+                expected = [item.id for item in transaction_manager.query(order_by=order_by)]
+                result = page_through(transaction_manager, 3, order_by)
+                self.assertEqual([item.id for item in result], expected)
+                self.assertEqual(len(result), 10)
+
     def test_account_for(self):
         #   Nothing given
         transaction_manager = TransactionManager(self.engine)
@@ -233,3 +729,57 @@ class TransactionManagerTestCase(unittest.TestCase):
             subcategory_id=self.subcategory.id,
         )
         self.assertEqual(tran.account_for_id, 2)
+
+
+class TransactionAggregateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        BaseModel.metadata.create_all(self.engine)
+        AccountManager(self.engine).create(name="Account")
+        CategoryManager(self.engine).create(name="Daily life")
+        SubcategoryManager(self.engine).create(name="Food", category_id=1)
+        self.manager = TransactionManager(self.engine)
+        self.row = {"account_id": 1, "category_id": 1, "subcategory_id": 1}
+
+    def get_rollup(self) -> dict[tuple, tuple]:
+        with Session(self.engine) as sess:
+            data = sess.scalars(select(TransactionAggregateModel)).all()
+        return {
+            tuple(getattr(item, key) for key in self.manager.aggregate_keys): (
+                item.amount,
+                item.count,
+            )
+            for item in data
+        }
+
+    def assert_rollup(self):
+        with Session(self.engine) as sess:
+            expected = self.get_rollup()
+            sess.execute(delete(TransactionAggregateModel))
+            sess.commit()
+        self.manager.refresh_aggregates()
+        self.assertEqual(self.get_rollup(), expected)
+
+    def test_write_paths(self):
+        first = self.manager.create(**self.row, amount=10, transaction_date="2024-01-05")
+        self.manager.create_many([
+            {**self.row, "amount": "2.5", "transaction_date": "2024-01-06"},
+            {**self.row, "amount": 4, "transaction_date": "2024-02-01", "code": "a"},
+        ])
+        self.assert_rollup()
+        self.assertEqual(sorted(self.get_rollup().values()), [(4, 1), (Decimal("12.5"), 2)])
+
+        #   Moved to another period
+        self.manager.upsert(**self.row, amount=5, transaction_date="2024-03-01", code="a")
+        self.assert_rollup()
+        self.manager.update(first.id, period_id=3, amount=1)
+        self.assert_rollup()
+        self.manager.update_many({"period_id": 3}, {"period_id": 1})
+        self.assert_rollup()
+        self.assertEqual(sorted(self.get_rollup().values()), [(Decimal("8.5"), 3)])
+
+        self.manager.delete(first.id)
+        self.assert_rollup()
+        self.manager.delete_many({"amount__gt": 3})
+        self.assertEqual(sorted(self.get_rollup().values()), [(Decimal("2.5"), 1)])
+        self.assert_rollup()
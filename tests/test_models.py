@@ -2,8 +2,12 @@
 Unit tests for models
 """
 
+from decimal import Decimal
+import io
 import unittest
+from unittest.mock import MagicMock, patch
 
+import colorama
 import sqlalchemy
 
 from finance_tracker.models import (
@@ -11,6 +15,7 @@ from finance_tracker.models import (
     BaseModel,
     BusinessModel,
     CategoryModel,
+    Money,
     SubcategoryModel,
     TransactionModel,
 )
@@ -27,6 +32,49 @@ class TestBase(unittest.TestCase):
         self.session.rollback()
 
 
+class ReprTestCase(unittest.TestCase):
+    def test_plain(self):
+        with patch("sys.stdout", io.StringIO()):
+            result = repr(AccountModel(id=1, name="some_name"))
+        self.assertEqual(result, "AccountModel(id='1', name='some_name')")
+
+    def test_color(self):
+        tty = MagicMock()
+        tty.isatty.return_value = True
+        with patch("sys.stdout", tty):
+            result = repr(AccountModel(id=1, name="some_name"))
+        self.assertIn(f"id='{colorama.Style.BRIGHT}1{colorama.Style.RESET_ALL}'", result)
+
+    def test_column_order(self):
+        with patch("sys.stdout", io.StringIO()):
+            result = repr(CategoryModel(name="cat", id=2))
+            transaction = repr(TransactionModel(amount=1, category=CategoryModel(name="cat")))
+        self.assertEqual(result, "CategoryModel(id='2', name='cat')")
+        self.assertTrue(transaction.startswith("TransactionModel(id='None', code="))
+        self.assertTrue(transaction.endswith("category='cat')"))
+
+
+class MoneyTestCase(unittest.TestCase):
+    def test_bind(self):
+        money = Money()
+        for value, expected in [
+            (Decimal("12.34"), 1234),
+            ("0.1", 10),
+            (0.1 + 0.2, 30),
+            (5, 500),
+            (Decimal("-1.005"), -101),
+            (None, None),
+        ]:
+            with self.subTest(value=value):
+                self.assertEqual(money.process_bind_param(value, None), expected)
+
+    def test_result(self):
+        money = Money()
+        self.assertEqual(money.process_result_value(1234, None), Decimal("12.34"))
+        self.assertEqual(money.process_result_value(278.5, None), Decimal("2.785"))
+        self.assertIsNone(money.process_result_value(None, None))
+
+
 class AccountModelTestCase(TestBase):
     def test_account(self):
         result = AccountModel(name="some_name")
@@ -4,6 +4,7 @@ Tests for the QR code handler
 
 from dataclasses import asdict
 import datetime as dt
+from decimal import Decimal
 import unittest
 
 from finance_tracker.qr_handler import (
@@ -35,7 +36,7 @@ class QRDataTestCase(unittest.TestCase):
             "transaction_code": "transaction_code",
             "date": dt.date(2022, 1, 1),
             "time": dt.time(0, 1, 23),
-            "amount": 12.51,
+            "amount": Decimal("12.51"),
             "datetime": dt.datetime(2022, 1, 1, 0, 1, 23),
         }
 
@@ -0,0 +1,48 @@
+"""
+Micro-benchmark of printing model objects
+
+Usage:
+    python -m utils.benchmark_repr [ROWS]
+"""
+
+import datetime as dt
+from decimal import Decimal
+import io
+import sys
+import time
+
+from finance_tracker.models import TransactionModel
+
+
+def make_rows(count: int) -> list[TransactionModel]:
+    return [
+        TransactionModel(
+            id=index,
+            code=f"code-{index}",
+            amount=Decimal("12.34"),
+            transaction_date=dt.date(2024, 1, 1),
+            account_id=1,
+            account_for_id=1,
+            category_id=2,
+            subcategory_id=3,
+            business_id=4,
+            period_id=5,
+        )
+        for index in range(count)
+    ]
+
+
+def main(count: int = 10_000, repeat: int = 5):
+    rows = make_rows(count)
+    out = io.StringIO()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out.write("\n".join(repr(item) for item in rows))
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{count} rows in {best:.3f}s: {count / best:,.0f} rows per second")
+
+
+if __name__ == "__main__":
+    main(*(int(item) for item in sys.argv[1:2]))